@@ -3,6 +3,51 @@
 # Copyright 2018 Paul Ashton
 # Sponsored by Rusty Brown's Ring Donuts
 
+# v7
+# - Add mmap load mode backed by a compact FieldIndex (use_mmap=True)
+# - Add iterDocuments generator for streaming Named Page Groups
+# - Build the Begin/End field tree in a single pass on load, kept in arrays
+#   (StructureTree) with StructureNode views. Page fields are sliced when used
+# - Pages are now parsed lazily through an LRU PageCache (page_cache_size)
+# - Add mapDocuments for parsing documents in a process pool
+# - Decode text with precomputed code page tables, selectable with codepage or
+#   taken from the code page resource
+# - Table driven PTOCA interpreter, unhandled functions are counted in
+#   unhandled_functions rather than printed
+# - Add optional columnar (numpy/array backed) element filtering to Page
+# - Area queries use a y sorted index built on the first area query
+# - Add optional TextIndex (buildTextIndex) for fast findText across documents
+# - Rework mergeElements into a single pass line builder with baseline
+#   tolerance and gap support, lines are cached on the page (getLines)
+# - Overlays are parsed once and shared, pages only place them (PlacedOverlay)
+#   when their elements are first used. incorporateOverlays is honoured again
+# - Image resources can be streamed (stream_images) and are saved with the
+#   extension of their real format, optionally by a thread pool
+# - Add benchmark.py with a deterministic synthetic AFP writer (SyntheticAFP)
+# - Add collect_stats (per phase timings, field, byte and PTOCA function counts,
+#   see statsInfo) and phase hooks (addHook)
+# - Add a sidecar index (use_index, saveIndex) so unchanged files re-open
+#   from the index and an mmap without reading or re-structuring them
+# - Add TLE-only scan (scanTLEs) and a TLE index for findDocuments(key=value)
+# - Add an asyncio API: openAsync, openManyAsync, iterDocumentsAsync and
+#   iterPagesAsync, work runs on a (configurable) executor
+# - Replace the example __main__ with a batch command line (JSONL/CSV output,
+#   process pool, throughput report, files that fail are reported and skipped)
+# - Add compact_elements, pages and overlays keep their elements in packed
+#   ElementArrays (rules stored separately) that index like tuples
+# - Add zero_copy, field payloads are memoryviews of one buffer. PTX payloads
+#   are decoded once and TRN text sliced from that
+# - Add include_fields/exclude_fields (setFieldFilter), payloads of filtered
+#   field types are seeked past and never read. See BULK_DATA_FIELDS and
+#   FILTER_KEEP_FIELDS
+# - Add tail following for spools still being written: follow(), refresh()
+#   and followDocuments()
+# - Add random access with getDocument(n) and getPage(doc, n) (and slices),
+#   reading only their byte ranges from a header-only OffsetTable (scanOffsets)
+# - Add findPatterns for many literal (Aho-Corasick) and regex patterns in a
+#   single pass with PatternSet, with per document limits. findText compiles
+#   its regex once
+#
 # v6
 # - Rework ptocadat parser
 # - Add MergeElements method
@@ -30,11 +75,38 @@
 # v1
 # - Initial release.
 
+import argparse
+import asyncio
+import bisect
 import codecs
+import concurrent.futures
+import contextlib
+import csv
+import functools
+import glob
+import hashlib
+import io
+import itertools
+import json
+import mmap
 import os
 import re
 import struct
+import sys
+import threading
 import time
+from array import array
+from collections import OrderedDict, deque
+
+try:
+    from re import _parser as sre_parse # Python 3.11+
+except ImportError:
+    import sre_parse
+
+try:
+    import numpy
+except ImportError:
+    numpy = None # Columnar pages fall back to array + python filtering
 
 # Contants..
 
@@ -307,525 +379,2910 @@ afp_clut = {
     0xffff: 0x000000, # Default Indicator
     }
 
-class Document(object):
-    def __init__(self, pages=[], tle={}):
-        self.pages = pages
-        self.tle = tle
+# PTOCA interpreter ops, afp_function_ops maps every function code to one..
+OP_UNKNOWN = 0
+OP_UNHANDLED = 1
+OP_IGNORE = 2
+OP_TRN = 3
+OP_AMI = 4
+OP_AMB = 5
+OP_STC = 6
+OP_SEC = 7
+OP_STO = 8
+OP_DIR = 9
+OP_DBR = 10
+
+afp_function_ops = [OP_UNKNOWN] * 256
+for _name, _op in (
+        ("TRN", OP_TRN), ("AMI", OP_AMI), ("AMB", OP_AMB), ("STC", OP_STC), ("SEC", OP_SEC),
+        ("STO", OP_STO), ("DIR", OP_DIR), ("DBR", OP_DBR),
+        ("NOP", OP_IGNORE), ("SCFL", OP_IGNORE), ("SIA", OP_IGNORE), ("SVI", OP_IGNORE),
+        ("RMI", OP_IGNORE), ("RMB", OP_IGNORE),
+        ("BSU", OP_UNHANDLED), ("ESU", OP_UNHANDLED), ("RPS", OP_UNHANDLED)):
+    for _code in afp_functions[_name]:
+        afp_function_ops[_code] = _op
+afp_function_ops = tuple(afp_function_ops)
+del _name, _op, _code
+
+_PTOCA_H = struct.Struct(">H")
+_PTOCA_HH = struct.Struct(">HH")
+_PTOCA_RULE = struct.Struct(">HHB")
+
+# Code Page Global IDs (from the Code Page Descriptor) we have a codec for..
+afp_codepages = {
+    37: "cp037", # USA/Canada
+    273: "cp273", # Germany/Austria
+    424: "cp424", # Hebrew
+    500: "cp500", # International
+    875: "cp875", # Greek
+    1026: "cp1026", # Turkish
+    1140: "cp1140", # USA/Canada (euro)
+    }
 
-    def getText(self):
+DEFAULT_CODEPAGE = "EBCDIC-CP-BE" # cp500
+
+_decoding_tables = {}
+
+def _getDecodingTables(codepage):
+    """
+    Return (plain, text) 256 entry decoding tables for codepage.
+    The text table has the quote fix-ups for TRN data folded in.
+    Tables are built once per codepage and shared.
+    """
+    tables = _decoding_tables.get(codepage)
+    if tables == None:
+        plain = bytes(range(256)).decode(codepage, "replace")
+        text = plain.replace("\x16", "'").replace("\x91", "'") # Fix quotes
+        tables = _decoding_tables[codepage] = (plain, text)
+    return tables
+
+# Image formats by the magic bytes their data starts with..
+afp_image_formats = (
+    (b"\xff\xd8\xff", "jpg"),
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"GIF87a", "gif"),
+    (b"GIF89a", "gif"),
+    (b"II*\x00", "tif"),
+    (b"MM\x00*", "tif"),
+    (b"\x00\x00\x00\x0cjP  \r\n\x87\n", "jp2"),
+    (b"\xff\x4f\xff\x51", "j2k"),
+    (b"BM", "bmp"),
+    )
+
+# Bulky data fields (image, graphics, object container and font raster data),
+# for exclude_fields when only text or TLEs are wanted..
+BULK_DATA_FIELDS = (SF_IPD, SF_GAD, SF_OCD, SF_FNG)
+
+# Fields the field filter always reads, like Begin/End fields. Pages find
+# their overlays with SF_IPO and the code page is taken from SF_CPD..
+FILTER_KEEP_FIELDS = frozenset((SF_IPO, SF_CPD))
+
+# Structured field introducer: CC, length, id (3 bytes split as B+H), flags, reserved
+SF_HEADER = struct.Struct(">BHBH3x")
+SF_HEADER_SIZE = SF_HEADER.size # 9
+
+# Sidecar index files (see AshyAFP.saveIndex)..
+INDEX_MAGIC = b"AFPIDX\n"
+INDEX_VERSION = 1
+INDEX_SUFFIX = ".afpidx"
+INDEX_HASH_CHUNK = 1 << 20 # Bytes hashed from the start and end of the file
+OFFSETS_SUFFIX = ".afpoff" # Sidecar of the OffsetTable (see AshyAFP.scanOffsets)
+MAP_SHARD_SIZE = 100 # Most documents per mapDocuments shard by default
+
+
+class FieldIndex(object):
+    """
+    Compact index of the structured fields in a buffer (usually an mmap)
+
+    Rather than holding a (sf_id, bytes) tuple for every field we keep
+    three parallel arrays of payload offset, payload length and field id.
+    Payloads are only sliced out of the buffer when a field is accessed.
+
+    Behaves like the list of (sf_id, data) tuples that load() used to
+    build so it can be used anywhere self.data is expected. Slicing
+    returns a view sharing the same arrays and buffer.
+
+    If view is set (a memoryview of buffer, see useViews) payloads are
+    returned as memoryview slices of it rather than copied out as bytes.
+    """
+    def __init__(self, buffer, offsets=None, lengths=None, ids=None, start=0, stop=None):
+        self.buffer = buffer
+        self.offsets = offsets if offsets != None else array("Q") # Payload offset in buffer
+        self.lengths = lengths if lengths != None else array("H") # Payload length (max 32759)
+        self.ids = ids if ids != None else array("I") # Field id
+        self.start = start
+        self.stop = stop
+        self.view = None
+
+    def useViews(self):
         """
-        Return all pages text separated by a pagebreak
+        Return payloads as memoryviews of the buffer from now on
         """
-        return '\x0c'.join(i.getText() for i in self.pages)
+        if self.view == None:
+            self.view = memoryview(self.buffer)
+        return self
 
-    def findText(self, text, rx=True, exactMatch=False):
+    def release(self):
         """
-        Return all instances of text on all pages
+        Release the memoryview of the buffer (payload views already handed out stay valid)
         """
-        assert self.pages, "No pages!"
+        if self.view != None:
+            self.view.release()
+            self.view = None
+
+    def append(self, sf_id, offset, length):
+        self.ids.append(sf_id)
+        self.offsets.append(offset)
+        self.lengths.append(length)
+
+    def _stop(self):
+        return len(self.ids) if self.stop == None else self.stop
+
+    def __len__(self):
+        return self._stop() - self.start
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            assert step == 1, "FieldIndex does not support stepped slices"
+            index = FieldIndex(self.buffer, self.offsets, self.lengths, self.ids,
+                start=self.start+start, stop=self.start+max(start, stop))
+            index.view = self.view
+            return index
+
+        if key < 0:
+            key += len(self)
+        if key < 0 or key >= len(self):
+            raise IndexError("FieldIndex index out of range")
+
+        return self.field(self.start+key)
+
+    def __iter__(self):
+        for i in range(self.start, self._stop()):
+            yield self.field(i)
+
+    def field(self, i):
+        """
+        Return (sf_id, data) for absolute field number i
+        """
+        offset = self.offsets[i]
+        buffer = self.buffer if self.view == None else self.view
+        return (self.ids[i], buffer[offset:offset+self.lengths[i]])
 
-        results = []
-        for page_num, page in enumerate(self.pages):
-            result = page.findText(text, rx=rx, exactMatch=exactMatch)
-            if result:
-                for i in result:
-                    results.append((page_num,) + i) # Include the page number
+    def fieldIds(self):
+        """
+        Return the field ids covered by this index (or view)
+        """
+        return self.ids[self.start:self._stop()]
 
-        return results
+    def byteRange(self, start, end):
+        """
+        Return the (begin, end) byte offsets in the buffer covering the
+        absolute fields start..end inclusive, headers included
+        """
+        return (self.offsets[start]-SF_HEADER_SIZE, self.offsets[end]+self.lengths[end])
 
-    def addPage(self, page):
-        self.pages.append(page)
+    def indexSize(self):
+        """
+        Return the number of bytes used by the index arrays
+        """
+        return sum(a.itemsize * len(a) for a in (self.offsets, self.lengths, self.ids))
 
 
-class Page(object):
-    def __init__(self, elements=None):
-        self.elements = tuple(elements) if elements != None else None
+class StructureTree(object):
+    """
+    The Begin/End nesting tree of the structured fields, kept in arrays.
 
-    def mergeElements(self, elements, delimiter=" "):
+    Nodes are numbered in file (pre) order, node 0 is the root covering all
+    data. Every node has an id (0 for the root), the (inclusive) field index
+    positions of its Begin and End fields and its parent's number. As a
+    node's descendants are the nodes after it that begin before its end,
+    subtrees are found by bisecting the starts. tle_nodes and tle_fields
+    (sorted by node) hold the field positions of the SF_TLE fields found
+    directly inside each node.
+
+    StructureNode objects are only made as views of a node when needed.
+    """
+    def __init__(self, ids=None, starts=None, ends=None, parents=None, tle_nodes=None, tle_fields=None):
+        self.ids = ids if ids != None else array("I")
+        self.starts = starts if starts != None else array("Q")
+        self.ends = ends if ends != None else array("Q")
+        self.parents = parents if parents != None else array("q")
+        self.tle_nodes = tle_nodes if tle_nodes != None else array("Q")
+        self.tle_fields = tle_fields if tle_fields != None else array("Q")
+
+    def __len__(self):
+        return len(self.ids)
+
+    def subtreeEnd(self, num):
         """
-        Merge all elements that are on the same Y coord.
-        Returns new list of merged elements.
-        ie.
-            (416, 3791, 0, 0, 'For'), (526, 3791, 0, 0, 'example')
-        will become:
-            (416, 3791, 0, 0, 'For example')
+        Return the number after the last descendant of node num
+        """
+        return bisect.bisect_right(self.starts, self.ends[num], num + 1)
+
+    def findNumbers(self, sf_id, num=0):
         """
-        elements = tuple(elements) # Ensure we're working with a tuple
+        Return an array of the numbers of the descendants of node num of type
+        sf_id in file order. We don't look inside matching nodes for more of
+        the same type.
+        """
+        ids = self.ids
+        found = array("Q")
+        i = num + 1
+        stop = self.subtreeEnd(num)
+        while i < stop:
+            if ids[i] == sf_id:
+                found.append(i)
+                i = self.subtreeEnd(i) # Skip its descendants
+            else:
+                i += 1
+        return found
 
-        newElements = []
+    def ranges(self, sf_id, num=0):
+        """
+        Return arrays of the start and end field positions of the nodes
+        findNumbers() finds
+        """
+        starts, ends = array("Q"), array("Q")
+        for i in self.findNumbers(sf_id, num):
+            starts.append(self.starts[i])
+            ends.append(self.ends[i])
+        return starts, ends
 
-        # Get all Y positions in order..
-        ypositions = sorted(set([i[1] for i in elements]))
+    def tleIndexes(self, num):
+        """
+        Return the field positions of all SF_TLE fields within node num (and its descendants)
+        """
+        first = bisect.bisect_left(self.tle_nodes, num)
+        last = bisect.bisect_left(self.tle_nodes, self.subtreeEnd(num), first)
+        return sorted(self.tle_fields[first:last])
 
-        for ypos in ypositions:
-            # Get all elements on this line..
-            lineElements = [i for i in elements if i[1]==ypos]
+    def memorySize(self):
+        """
+        Return the number of bytes used by the tree arrays
+        """
+        return sum(a.itemsize * len(a) for a in self.arrays())
 
-            # Ensure they're in the correct order
-            lineElements = sorted(lineElements, key=lambda _: _[0])
+    def arrays(self):
+        return (self.ids, self.starts, self.ends, self.parents, self.tle_nodes, self.tle_fields)
 
-            # Add to newElements list..
-            if len(lineElements) == 1:
-                # Only one element on this line..
-                newElements.append(lineElements[0])
-            else:
-                # Multiple elements need to be joined..
-                newText = delimiter.join([i[4] for i in lineElements if i[4].strip()])
-                newElements.append(lineElements[0][:4] + (newText,)) # Use the original x, y, c, o data along with new text
 
-        return newElements
+class StructureNode(object):
+    """
+    A Begin/End pair in the structured field nesting tree, a view of node
+    num of a StructureTree.
 
-    def getText(self, area=None, delimiter="\n", sort=True, strip=True, color=None, mergeInlineElements=False):
+    start and end are the (inclusive) field index positions of the Begin and
+    End fields. The root node has no sf_id and covers all data.
+    """
+    __slots__ = ("tree", "num")
+
+    def __init__(self, tree, num=0):
+        self.tree = tree
+        self.num = num
+
+    def __repr__(self):
+        return f"StructureNode({afp_fields.get(self.sf_id, self.sf_id)!r}, {self.start}, {self.end}, children={len(self.children)})"
+
+    @property
+    def sf_id(self):
+        return self.tree.ids[self.num] or None
+
+    @property
+    def start(self):
+        return self.tree.starts[self.num]
+
+    @property
+    def end(self):
+        return self.tree.ends[self.num]
+
+    @property
+    def children(self):
+        tree = self.tree
+        children = []
+        i = self.num + 1
+        stop = tree.subtreeEnd(self.num)
+        while i < stop:
+            children.append(StructureNode(tree, i))
+            i = tree.subtreeEnd(i)
+        return children
+
+    def find(self, sf_id):
         """
-        Return all text on page or in given area
-        Separated by delimiter
+        Yield all descendant nodes of type sf_id in file order.
+        We don't look inside matching nodes for more of the same type.
+        """
+        for i in self.tree.findNumbers(sf_id, self.num):
+            yield StructureNode(self.tree, i)
 
-        Area should be a tuple of (x1, y1, x2, y2)
+    def walk(self):
+        """
+        Yield this node and all of its descendants in file order
+        """
+        for i in range(self.num, self.tree.subtreeEnd(self.num)):
+            yield StructureNode(self.tree, i)
 
-        We ignore anything with an orientation of -1 as this is an
-        I or B-Rule and those can be retrieved using getRules()
+    def tleIndexes(self):
+        """
+        Return index positions of all SF_TLE fields within this node (and its children)
+        """
+        return self.tree.tleIndexes(self.num)
 
-        sort will sort elements by their position on the page so we
-        get text out in the correct(ish) order.
+    def fields(self, data):
         """
-        if not self.elements:
-            return ""
+        Return the fields for this node from data (Begin and End fields included)
+        """
+        return data[self.start:self.end+1]
 
-        # Get elements..
-        if area != None:
-            items = (i for i in self.elements if i[3] != -1 and i[0] >= area[0] and i[0] <= area[2] and i[1] >= area[1] and i[1] <= area[3])
-        else:
-            items = (i for i in self.elements if i[3] != -1)
+    def toArrays(self):
+        """
+        Return the tree's arrays for the sidecar index: node ids, starts,
+        ends and parent node numbers (file order, the root is node 0 with
+        id 0) plus the node numbers and field positions of their TLEs.
+        """
+        assert self.num == 0, "Only the root can be saved"
+        return self.tree.arrays()
 
-        if not items:
-            return ()
+    @classmethod
+    def fromArrays(cls, ids, starts, ends, parents, tle_nodes, tle_fields):
+        """
+        Return the root node of the tree in the arrays of toArrays()
+        """
+        return cls(StructureTree(ids, starts, ends, parents, tle_nodes, tle_fields))
 
-        # Sort items if needed..
-        if sort:
-            items = sorted(items, key=lambda x: (x[1], x[0]))
 
-        # Filter by color..
-        if color != None:
-            items = (i for i in items if i[2]==color)
+class FieldRanges(object):
+    """
+    Sequence of the fields of a list of (start, end) field position ranges
+    of data, kept as two arrays. The fields (data[start:end+1]) are only
+    sliced out when an item is accessed.
+    """
+    def __init__(self, data, starts, ends):
+        self.data = data
+        self.starts = starts
+        self.ends = ends
 
-        # Filter empty (whitespace only) elements..
-        if strip:
-            items = ((x, y, c, o, t.strip()) for x, y, c, o, t in tuple(items) if t.strip())
+    def __len__(self):
+        return len(self.starts)
 
-        # Merge texts?
-        if mergeInlineElements:
-            items = self.mergeElements(items)
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return [self[i] for i in range(*key.indices(len(self)))]
+        return self.data[self.starts[key]:self.ends[key]+1]
 
-        # Join the texts and return..
-        return delimiter.join((i[4] for i in items))
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
 
-    def getTextElements(self, area=None, sort=True, color=None, mergeInlineElements=False):
-        """
-        Return all text elements on page or in given area
 
-        Area should be a tuple of (x1, y1, x2, y2)
+class OffsetTable(object):
+    """
+    Byte ranges of the resources, documents (Named Page Groups) and pages
+    of a file from a header-only scan, see AshyAFP.scanOffsets().
 
-        We ignore anything with an orientation of -1 as this is an
-        I or B-Rule and those can be retrieved using getRules()
+    Document and page ranges are kept in arrays so the table stays small
+    for archives with millions of them and any one can be looked up
+    directly. Pages are numbered across the file, document_pages and
+    document_page_counts give each document's first page and page count.
+    """
+    def __init__(self):
+        self.resources = [] # (begin, end)
+        self.document_begins = array("Q")
+        self.document_ends = array("Q")
+        self.document_pages = array("Q")
+        self.document_page_counts = array("Q")
+        self.page_begins = array("Q")
+        self.page_ends = array("Q")
+
+    def __repr__(self):
+        return f"OffsetTable({len(self.resources)} resources, {self.documentCount()} documents, {self.pageCount()} pages)"
+
+    def addDocument(self, begin, end, first_page):
+        self.document_begins.append(begin)
+        self.document_ends.append(end)
+        self.document_pages.append(first_page)
+        self.document_page_counts.append(len(self.page_begins) - first_page)
+
+    def addPage(self, begin, end):
+        self.page_begins.append(begin)
+        self.page_ends.append(end)
+
+    def documentCount(self):
+        return len(self.document_begins)
+
+    def pageCount(self, doc_num=None):
+        """
+        Return the number of pages in document doc_num, or in the file if None
+        """
+        if doc_num == None:
+            return len(self.page_begins)
+        return self.document_page_counts[doc_num]
 
-        sort will sort elements by their position on the page so we
-        get text out in the correct(ish) order.
+    def documentRange(self, doc_num):
         """
-        if not self.elements:
-            return ()
+        Return the (begin, end) byte range of document doc_num
+        """
+        return (self.document_begins[doc_num], self.document_ends[doc_num])
 
-        if sort:
-            items = sorted(self.elements, key=lambda x: (x[1], x[0]))
+    def pageNumber(self, doc_num, page_num):
+        """
+        Return the file wide number of page page_num of document doc_num
+        (doc_num None for page_num to be file wide already)
+        """
+        if doc_num == None:
+            count = len(self.page_begins)
+            first = 0
         else:
-            items = self.elements
+            count = self.document_page_counts[doc_num]
+            first = self.document_pages[doc_num]
 
-        if not items:
-            return ()
+        if page_num < 0:
+            page_num += count
+        if page_num < 0 or page_num >= count:
+            raise IndexError("page number out of range")
 
-        if area != None:
-            items = (i for i in items if i[3] != -1 and i[0] >= area[0] and i[0] <= area[2] and i[1] >= area[1] and i[1] <= area[3])
-        else:
-            items = (i for i in items if i[3] != -1)
+        return first + page_num
 
-        if color != None:
-            items = (i for i in items if i[2]==color)
+    def pageRange(self, number):
+        """
+        Return the (begin, end) byte range of file wide page number
+        """
+        return (self.page_begins[number], self.page_ends[number])
 
-        # Merge texts?
-        if mergeInlineElements:
-            items = self.mergeElements(items)
+    def arrays(self):
+        return (self.document_begins, self.document_ends, self.document_pages, self.document_page_counts, self.page_begins, self.page_ends)
 
-        return tuple(items)
+    @classmethod
+    def fromArrays(cls, resources, arrays):
+        table = cls()
+        table.resources = [tuple(i) for i in resources]
+        (table.document_begins, table.document_ends, table.document_pages, table.document_page_counts,
+            table.page_begins, table.page_ends) = arrays
+        return table
 
-    def getRules(self, area=None, color=None):
-        """
-        Return all rules on page or in given area
-        Area should be a tuple of (x1, y1, x2, y2)
 
-        We want orientation of -1 as I or B-Rule will be set to that
+class ImageResource(object):
+    """
+    An image resource streamed from its SF_IPD fields.
 
-        Returned elements will contain a tuple instead of text value at
-        position 4 like:
-            ("I-Rule", length, width)
-        """
-        assert self.elements, "No elements!"
-        assert area == None or isinstance(area, tuple), "specified area is not a tuple in the form: (x1, y1, x2, y2)"
+    segments holds (buffer, start, end) for every image data segment, the
+    buffer being the field payload or the mmap of the whole file, so
+    nothing is copied until the image is read or written.
+    """
+    __slots__ = ("name", "segments")
 
-        if area != None:
-            items = (i for i in self.elements if i[3] == -1 and i[0] >= area[0] and i[0] <= area[2] and i[1] >= area[1] and i[1] <= area[3])
-        else:
-            items = (i for i in self.elements if i[3] == -1)
+    def __init__(self, name, segments=None):
+        self.name = name
+        self.segments = segments if segments != None else []
 
-        if color != None:
-            items = (i for i in items if i[2]==color)
+    def __repr__(self):
+        return f"ImageResource({self.name!r}, {len(self)} bytes)"
 
-        return tuple(items)
+    def __len__(self):
+        return sum(end-start for buffer, start, end in self.segments)
 
-    def findTextPos(self, text, rx=True, exactMatch=False, color=None, area=None):
+    def chunks(self):
         """
-        Return the position of the first match
+        Yield a memoryview of every image data segment
         """
-        results = self.findText(text, rx=rx, exactMatch=exactMatch, color=color, area=area)
-        if results:
-            return results[0][0:2]
-        return None
+        for buffer, start, end in self.segments:
+            with memoryview(buffer) as view:
+                yield view[start:end]
 
-    def findText(self, text, rx=True, exactMatch=False, color=None, area=None, mergeInlineElements=False):
+    def read(self):
         """
-        Return the element containing given text
-        If color is specified then only text with that color will be returned.
+        Return the whole image as bytes
         """
-        items = []
-        for i in self.elements:
-            if i[3] == -1: # Ignore rules
-                continue
+        return b"".join(self.chunks())
 
-            if rx == True:
-                result = re.search(text, i[4])
-                if result:
-                    if not exactMatch or (exactMatch and result.group()==i[4]):
-                        items.append(i)
-            else:
-                if (exactMatch and i[4] == text) or (not exactMatch and text in i[4]):
-                    items.append(i)
+    def format(self):
+        """
+        Return the file extension for the image format, from the image data.
+        Unrecognised data (ie. uncompressed IOCA) is "bin".
+        """
+        header = b""
+        for chunk in self.chunks():
+            header += bytes(chunk[:16-len(header)])
+            if len(header) >= 16:
+                break
+
+        for magic, ext in afp_image_formats:
+            if header.startswith(magic):
+                return ext
+        return "bin"
+
+    def writeTo(self, fp):
+        """
+        Write the image to the file object fp one segment at a time.
+        Returns the number of bytes written.
+        """
+        size = 0
+        for buffer, start, end in self.segments:
+            with memoryview(buffer) as view, view[start:end] as chunk:
+                fp.write(chunk)
+            size += end-start
+        return size
 
-        if not items:
-            return ()
 
-        # Filter by area..
-        if area != None:
-            items = (i for i in items if (area[0] != None and i[0] >= area[0]) and (area[2] != None and i[0] <= area[2]) and (area[1] != None and i[1] >= area[1]) and (area[3] != None and i[1] <= area[3]))
+class Document(object):
+    def __init__(self, pages=[], tle={}):
+        self.pages = pages
+        self.tle = tle
 
-        # Filter by color..
-        if color != None:
-            items = (i for i in items if i[2]==color)
+    def getText(self):
+        """
+        Return all pages text separated by a pagebreak
+        """
+        return '\x0c'.join(i.getText() for i in self.pages)
 
-        # Merge texts?
-        if mergeInlineElements:
-            items = self.mergeElements(items)
+    def findText(self, text, rx=True, exactMatch=False):
+        """
+        Return all instances of text on all pages
+        """
+        assert self.pages, "No pages!"
 
-        return tuple(items)
+        results = []
+        for page_num, page in enumerate(self.pages):
+            result = page.findText(text, rx=rx, exactMatch=exactMatch)
+            if result:
+                for i in result:
+                    results.append((page_num,) + i) # Include the page number
 
-class AshyAFP(object):
-    """
-    Ashy's attempt to read AFP data without some shitty library
-    """
-    def __init__(self, filename=None, allow_unknown_fields=False, keep_all_resources=True, incorporateOverlays=True):
-        self.debug = False
+        return results
 
-        self.data = None # Holds whole AFP file
-        self.pages = None
-        self.documents = None
-        self.resources = None
+    def findPatterns(self, patterns, limit=None):
+        """
+        Return (page_num, pattern) + element for every pattern found on all
+        pages, stopping after limit hits. Pages after that are not parsed.
+        """
+        if not isinstance(patterns, PatternSet):
+            patterns = PatternSet(patterns)
 
-        self.page_count = 0
-        self.document_count = 0
-        self.resource_count = 0
+        results = []
+        for page_num, page in enumerate(self.pages):
+            remaining = None if limit == None else limit - len(results)
+            results.extend((page_num,) + i for i in page.findPatterns(patterns, limit=remaining))
+            if limit != None and len(results) >= limit:
+                break
 
-        self.unknown_field_count = 0
+        return results
 
-        self.filename = None
+    def addPage(self, page):
+        self.pages.append(page)
 
-        self.keep_all_resources = keep_all_resources
-        self.allow_unknown_fields = allow_unknown_fields
 
-        self.incorporateOverlays = incorporateOverlays
+class PageCache(object):
+    """
+    LRU cache of parsed Page objects shared by LazyPages sequences.
 
-        if filename != None:
-            self.load(filename)
+    maxsize limits how many parsed pages are held, None means unbounded
+    and 0 disables caching. hits and misses count lookups. The cache can
+    be shared by threads (see AshyAFP.iterPagesAsync), pages are parsed
+    outside of the lock.
+    """
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._pages = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._pages)
 
-    def saveImageResources(self, output_folder):
+    def get(self, key, parse, raw):
         """
-        Save all image resources to the output_folder
+        Return the cached page for key or parse(raw) it and cache the result
         """
-        if not self.resources:
-            return 0
+        with self._lock:
+            page = self._pages.get(key)
+            if page != None:
+                self.hits += 1
+                self._pages.move_to_end(key)
+                return page
+            self.misses += 1
 
-        os.makedirs(output_folder, exist_ok=True)
+        page = parse(raw)
 
-        for res in self.resources:
-            if isinstance(self.resources[res], bytes):
-                with open(os.path.join(output_folder, f"{res}.jpg"), "wb") as fp:
-                    fp.write(self.resources[res])
+        if self.maxsize != 0:
+            with self._lock:
+                self._pages[key] = page
+                if self.maxsize != None and len(self._pages) > self.maxsize:
+                    self._pages.popitem(last=False) # Drop the least recently used
 
-        return len(self.resources)
+        return page
 
-    def _getResources(self):
-        """
-        Parse resource fields to find jpg images.
-        Returns a dict of binary jpg-image data with resource name as the key
-        """
-        assert self.data, "No data loaded"
+    def clear(self):
+        with self._lock:
+            self._pages.clear()
+            self.hits = 0
+            self.misses = 0
 
-        self.resources = {}
+    def info(self):
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._pages), "maxsize": self.maxsize}
 
-        for res in self._getFieldsBetween(SF_BRS, SF_ERS):
-            # Get the resource name from the first entry (which is the BRS field)..
-            res_name = self.toASCII(res[0][1][0:8])
 
-            # Overlay Objects with Text element..
-            result = [t_dat for t_id, t_dat in res if t_id == SF_PTX]
-            if result:
-                self.resources[res_name] = self._parsePTOCAdat(result[0])
+class Stats(object):
+    """
+    Load and parse statistics of an AshyAFP, see AshyAFP(collect_stats=True).
 
-            # Image objects..
-            result = [t_dat for t_id, t_dat in res if t_id == SF_IPD]
-            if result:
-                img_data = b''
-                for ipd in result:
-                    i_id, i_len = struct.unpack_from(">HH", ipd)
-                    if i_id == 0xFE92: # Image Data header
-                        img_data += ipd[4:4+i_len]
-
-                if len(img_data):
-                    self.resources[res_name] = img_data
-            else:
-                self.resources[res_name] = res
+    timings holds the seconds spent in each phase, pages is accumulated as
+    pages are parsed. fields holds [count, bytes] per field id (bytes
+    include the introducer) and functions the count per PTOCA function code.
+    """
+    PHASES = ("read", "structure", "resources", "documents", "pages", "load")
 
-        return len(self.resources)
+    def __init__(self):
+        self.timings = dict.fromkeys(self.PHASES, 0.0)
+        self.fields = {}
+        self.functions = {}
+        self.pages_parsed = 0
 
-    def countFields(self, field_type, data=None):
+    def countFields(self, data):
         """
-        Return how many of this field_type there is in data
+        Count the fields and their bytes in data (list of fields or FieldIndex)
         """
-        if not data and self.data:
-            data = self.data
-        assert data, "No data loaded"
-        return len([1 for t_id, t_dat in data if t_id == field_type])
+        fields = self.fields
+        if isinstance(data, FieldIndex):
+            sizes = zip(data.fieldIds(), (data.lengths[i] for i in range(data.start, data._stop())))
+        else:
+            sizes = ((f_id, len(f_dat)) for f_id, f_dat in data)
 
-    def toASCII(self, ebcdic_text):
-        """
-        Convert EBCDIC encoded text to ASCII
+        for f_id, length in sizes:
+            entry = fields.get(f_id)
+            if entry == None:
+                entry = fields[f_id] = [0, 0]
+            entry[0] += 1
+            entry[1] += length + SF_HEADER_SIZE
 
-        Example:
-        >>> text = b'\xc3\xa4\xa2\xa3\x96\x94\x85\x99\xc9\x95\xd9\xa4\x95'
+    def countFunctions(self, data):
+        """
+        Count the function codes of the control sequences in PTOCA data.
+        This walks the lengths only, it is kept out of _parsePTOCAdat so the
+        interpreter costs nothing extra when stats are off.
+        """
+        functions = self.functions
+        offset = 0
+        size = len(data)
+        chained = False
+        while offset < size:
+            if not chained:
+                offset += 2 # ESC SEQ
+            length = data[offset]
+            if not length:
+                break
+            function = data[offset+1]
+            functions[function] = functions.get(function, 0) + 1
+            offset += length
+            chained = function & 1
+
+    def info(self, unknown_field_count=0, unhandled_functions=None):
+        """
+        Return the statistics as a JSON-able dict with field and function names
+        """
+        functions = {}
+        unknown_functions = {}
+        for function, count in sorted(self.functions.items()):
+            if afp_function_ops[function] == OP_UNKNOWN:
+                unknown_functions[hex(function)] = count
+            else:
+                functions[afp_functions_desc.get(function, hex(function))] = count
+
+        return {
+            "timings": dict(self.timings),
+            "pages_parsed": self.pages_parsed,
+            "fields": {afp_fields.get(f_id, hex(f_id)): {"count": count, "bytes": size} for f_id, (count, size) in sorted(self.fields.items())},
+            "functions": functions,
+            "unknown_functions": unknown_functions,
+            "unhandled_functions": {hex(k): v for k, v in sorted((unhandled_functions or {}).items())},
+            "unknown_fields": unknown_field_count,
+            }
+
+
+class LazyPages(object):
+    """
+    Sequence of pages which are only parsed when accessed.
+
+    Holds the raw page fields (a list, or FieldRanges so they are only
+    sliced out when used) and parses them with parse() on first access,
+    parsed pages are kept in the (shared) PageCache so jumping back and
+    forth between pages only pays the parse cost once per page.
+    Already parsed Page objects can be added with append().
+    """
+    _keys = itertools.count()
+
+    def __init__(self, rawpages, parse, cache):
+        self.rawpages = rawpages if isinstance(rawpages, FieldRanges) else list(rawpages)
+        self.parse = parse
+        self.cache = cache
+        self.key = next(self._keys) # Unique prefix for this sequence's cache keys
+
+    def __len__(self):
+        return len(self.rawpages)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return [self[i] for i in range(*key.indices(len(self)))]
+
+        raw = self.rawpages[key]
+        if isinstance(raw, Page):
+            return raw
+
+        if key < 0:
+            key += len(self)
+        return self.cache.get((self.key, key), self.parse, raw)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def append(self, page):
+        if isinstance(self.rawpages, FieldRanges):
+            self.rawpages = list(self.rawpages)
+        self.rawpages.append(page)
+
+
+class LazyDocuments(object):
+    """
+    Sequence of documents which are only built when accessed.
+
+    build(doc_num) returns the Document, it is kept once built. Used by
+    load() so a file with many documents (or one opened from the sidecar
+    index) doesn't build a Document and page list for each up front.
+    """
+    def __init__(self, count, build):
+        self.build = build
+        self._documents = [None] * count
+
+    def __len__(self):
+        return len(self._documents)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return [self[i] for i in range(*key.indices(len(self)))]
+
+        doc = self._documents[key]
+        if doc == None:
+            doc = self._documents[key] = self.build(key % len(self))
+        return doc
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
+class ElementArray(object):
+    """
+    Compact sequence of page elements, see AshyAFP(compact_elements=True).
+
+    x, y, color and orientation are packed into arrays and texts are
+    interned, rules are kept in their own arrays (their texts entry is
+    None). An element costs 21 bytes plus its text rather than about 150
+    for a 5-tuple and its int objects (measured on a 317k element
+    synthetic spool: 215 bytes/element with tuples, 77 compact, texts
+    included), parsing takes about half as long again. Indexing and
+    iterating give the usual (x, y, color, orientation, text) tuples so it
+    can be used anywhere a tuple of elements is.
+    """
+    __slots__ = ("xs", "ys", "colors", "orientations", "texts",
+        "rule_positions", "rule_kinds", "rule_lengths", "rule_widths", "rule_fractions")
+
+    RULE_KINDS = ("I-Rule", "B-Rule")
+
+    def __init__(self, elements=()):
+        self.xs = array("i")
+        self.ys = array("i")
+        self.colors = array("I")
+        self.orientations = array("b")
+        self.texts = []
+
+        # Rules, rule_positions holds their element positions..
+        self.rule_positions = array("I")
+        self.rule_kinds = array("B")
+        self.rule_lengths = array("H")
+        self.rule_widths = array("H")
+        self.rule_fractions = array("B")
+
+        if elements:
+            self.extend(elements)
+
+    def __repr__(self):
+        return f"ElementArray({len(self)} elements, {len(self.rule_positions)} rules)"
+
+    def __len__(self):
+        return len(self.texts)
+
+    def __eq__(self, other):
+        if isinstance(other, (ElementArray, tuple, list)):
+            return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+        return NotImplemented
+
+    __hash__ = None
+
+    def append(self, element):
+        x, y, color, orientation, text = element
+        self.xs.append(x)
+        self.ys.append(y)
+        self.colors.append(color)
+        self.orientations.append(orientation)
+
+        if orientation == -1:
+            self.rule_positions.append(len(self.texts))
+            self.rule_kinds.append(self.RULE_KINDS.index(text[0]))
+            self.rule_lengths.append(text[1])
+            self.rule_widths.append(text[2])
+            self.rule_fractions.append(text[3])
+            self.texts.append(None)
+        else:
+            self.texts.append(sys.intern(text))
+
+    def extend(self, elements):
+        if isinstance(elements, ElementArray):
+            offset = len(self.texts)
+            self.rule_positions.extend(i + offset for i in elements.rule_positions)
+            for name in ("xs", "ys", "colors", "orientations", "texts", "rule_kinds", "rule_lengths", "rule_widths", "rule_fractions"):
+                getattr(self, name).extend(getattr(elements, name))
+        else:
+            for element in elements:
+                self.append(element)
+
+    def rule(self, number):
+        """
+        Return the ("I-Rule"/"B-Rule", length, width, fraction) of rule number
+        """
+        return (self.RULE_KINDS[self.rule_kinds[number]], self.rule_lengths[number], self.rule_widths[number], self.rule_fractions[number])
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return tuple(self[i] for i in range(*key.indices(len(self))))
+
+        text = self.texts[key] # Raises IndexError for us
+        if key < 0:
+            key += len(self.texts)
+        if text == None:
+            text = self.rule(bisect.bisect_left(self.rule_positions, key))
+
+        return (self.xs[key], self.ys[key], self.colors[key], self.orientations[key], text)
+
+    def __iter__(self):
+        elements = zip(self.xs, self.ys, self.colors, self.orientations, self.texts)
+        if not self.rule_positions:
+            return elements
+        return self._iterRules(elements)
+
+    def _iterRules(self, elements):
+        rules = map(self.rule, range(len(self.rule_positions)))
+        for element in elements:
+            if element[4] == None:
+                yield element[:4] + (next(rules),)
+            else:
+                yield element
+
+    def moved(self, x, y):
+        """
+        Return a copy with every element moved by x and y
+        """
+        result = ElementArray()
+        result.extend(self)
+        result.xs = array("i", [i + x for i in self.xs])
+        result.ys = array("i", [i + y for i in self.ys])
+        return result
+
+    def memorySize(self):
+        """
+        Return the bytes used by the arrays, the texts list and the (unique) strings
+        """
+        size = sys.getsizeof(self.texts) + sum(sys.getsizeof(getattr(self, name)) for name in self.__slots__ if name != "texts")
+        return size + sum(sys.getsizeof(i) for i in {id(i): i for i in self.texts if i != None}.values())
+
+
+class PageColumns(object):
+    """
+    Columnar copy of a page's elements.
+
+    x, y, color and orientation are held in numpy arrays (or array.array if
+    numpy isn't installed) with the texts in a separate list. The (y, x)
+    ordering and the text/rule mask are computed once so area, color and
+    rule filters are vectorised rather than run per element in python.
+    """
+    def __init__(self, elements):
+        self.elements = elements
+        self.texts = [i[4] for i in elements]
+
+        count = len(elements)
+        if numpy != None:
+            self.xs = numpy.fromiter((i[0] for i in elements), dtype=numpy.int64, count=count)
+            self.ys = numpy.fromiter((i[1] for i in elements), dtype=numpy.int64, count=count)
+            self.colors = numpy.fromiter((i[2] for i in elements), dtype=numpy.int64, count=count)
+            self.orientations = numpy.fromiter((i[3] for i in elements), dtype=numpy.int64, count=count)
+            self.order = numpy.lexsort((self.xs, self.ys)) # Stable, by y then x
+            self.sorted_ys = self.ys[self.order] # For area lookups
+            self.text_mask = self.orientations != -1
+        else:
+            self.xs = array("q", (i[0] for i in elements))
+            self.ys = array("q", (i[1] for i in elements))
+            self.colors = array("q", (i[2] for i in elements))
+            self.orientations = array("q", (i[3] for i in elements))
+            self.order = sorted(range(count), key=lambda i: (self.ys[i], self.xs[i]))
+            self.sorted_ys = [self.ys[i] for i in self.order] # For area lookups
+            self.text_mask = [i != -1 for i in self.orientations]
+
+    def select(self, rules=False, area=None, color=None, sort=False):
+        """
+        Return the text elements (or rules) that are in area and have color.
+        If sort is True they are returned in (y, x) order otherwise in page order.
+        """
+        if numpy != None:
+            if area != None:
+                # Only look at the elements in the y range of area..
+                lo = numpy.searchsorted(self.sorted_ys, area[1], side="left")
+                hi = numpy.searchsorted(self.sorted_ys, area[3], side="right")
+                indexes = self.order[lo:hi]
+
+                xs = self.xs[indexes]
+                mask = (xs >= area[0]) & (xs <= area[2]) & (self.text_mask[indexes] != rules)
+                if color != None:
+                    mask &= self.colors[indexes] == color
+
+                indexes = indexes[mask]
+                if not sort:
+                    indexes.sort()
+            else:
+                mask = ~self.text_mask if rules else self.text_mask
+                if color != None:
+                    mask = mask & (self.colors == color)
+
+                indexes = self.order[mask[self.order]] if sort else numpy.flatnonzero(mask)
+
+            indexes = indexes.tolist()
+        else:
+            xs, colors, text_mask = self.xs, self.colors, self.text_mask
+            if area != None:
+                # Only look at the elements in the y range of area..
+                lo = bisect.bisect_left(self.sorted_ys, area[1])
+                hi = bisect.bisect_right(self.sorted_ys, area[3])
+                indexes = [i for i in self.order[lo:hi]
+                    if text_mask[i] != rules and xs[i] >= area[0] and xs[i] <= area[2]
+                    and (color == None or colors[i] == color)]
+                if not sort:
+                    indexes.sort()
+            else:
+                indexes = [i for i in (self.order if sort else range(len(self.elements)))
+                    if text_mask[i] != rules and (color == None or colors[i] == color)]
+
+        elements = self.elements
+        return [elements[i] for i in indexes]
+
+
+class Line(object):
+    """
+    A line of text elements built by Page.buildLines.
+    x, y, color and orientation are taken from the first (leftmost) element.
+    """
+    __slots__ = ("x", "y", "color", "orientation", "text", "elements")
+
+    def __init__(self, elements, delimiter=" "):
+        first = elements[0]
+        self.x, self.y, self.color, self.orientation = first[:4]
+        self.elements = tuple(elements)
+
+        if len(elements) == 1:
+            self.text = first[4]
+        else:
+            self.text = delimiter.join([i[4] for i in elements if i[4].strip()])
+
+    def __repr__(self):
+        return f"Line({self.x}, {self.y}, {self.text!r})"
+
+    def element(self):
+        """
+        Return the line as a text element tuple (the original one if only one element)
+        """
+        if len(self.elements) == 1:
+            return self.elements[0]
+        return (self.x, self.y, self.color, self.orientation, self.text)
+
+
+class PlacedOverlay(object):
+    """
+    An overlay included on a page: the overlay's shared text elements and
+    the x and y origin they are moved to on this page.
+    """
+    __slots__ = ("name", "elements", "x", "y")
+
+    def __init__(self, name, elements, x, y):
+        self.name = name
+        self.elements = elements
+        self.x = x
+        self.y = y
+
+    def __repr__(self):
+        return f"PlacedOverlay({self.name!r}, {self.x}, {self.y})"
+
+    def placedElements(self):
+        """
+        Return the overlay's text elements moved to this origin
+        """
+        x, y = self.x, self.y
+        if isinstance(self.elements, ElementArray):
+            return self.elements.moved(x, y)
+        return [(t[0]+x, t[1]+y) + t[2:] for t in self.elements]
+
+
+class Page(object):
+    def __init__(self, elements=None, columnar=False, line_tolerance=0, line_gap=None, parts=None):
+        """
+        A page is made from either elements or parts: a list of runs of
+        element lists and PlacedOverlays. Parts are only combined into
+        elements the first time they are used.
+        """
+        self.parts = parts
+        self._elements = elements if elements == None or isinstance(elements, ElementArray) else tuple(elements)
+        self.columnar = columnar # Use PageColumns for filtering and sorting
+        self._columns = None
+        self._area_index = None # (sorted y positions, element indexes, xs, orientations) built on first area query
+
+        # Line building for mergeInlineElements..
+        self.line_tolerance = line_tolerance # Max baseline difference within a line
+        self.line_gap = line_gap # Max x distance between joined elements (None for no limit)
+        self._lines = {} # Cached getLines() results
+
+    def _areaElements(self, area, rules=False, sort=True):
+        """
+        Return the text elements (or rules) within area.
+
+        Uses an index of the elements sorted by (y, x) so only elements
+        in the y range of area are looked at. The index is built on the
+        first area query. Results are in (y, x) order if sort is True
+        otherwise in page order.
+        """
+        elements = self.elements
+
+        if self._area_index == None:
+            if isinstance(elements, ElementArray):
+                xs, ys, orientations = elements.xs, elements.ys, elements.orientations
+            else:
+                xs, ys, orientations = [i[0] for i in elements], [i[1] for i in elements], [i[3] for i in elements]
+            order = sorted(range(len(elements)), key=lambda i: (ys[i], xs[i]))
+            self._area_index = ([ys[i] for i in order], order, xs, orientations)
+
+        ys, order, xs, orientations = self._area_index
+        x1, y1, x2, y2 = area
+
+        indexes = [i for i in order[bisect.bisect_left(ys, y1):bisect.bisect_right(ys, y2)]
+            if (orientations[i] == -1) == rules and xs[i] >= x1 and xs[i] <= x2]
+        if not sort:
+            indexes.sort()
+
+        return [elements[i] for i in indexes]
+
+    @property
+    def elements(self):
+        if self._elements == None and self.parts != None:
+            # Compact pages stay compact..
+            compact = any(isinstance(i.elements if isinstance(i, PlacedOverlay) else i, ElementArray) for i in self.parts)
+            elements = ElementArray() if compact else []
+            for part in self.parts:
+                if isinstance(part, PlacedOverlay):
+                    elements.extend(part.placedElements())
+                else:
+                    elements.extend(part)
+            self._elements = elements if compact else tuple(elements)
+        return self._elements
+
+    @elements.setter
+    def elements(self, elements):
+        if elements == None or isinstance(elements, ElementArray):
+            self._elements = elements
+        else:
+            self._elements = tuple(elements)
+        self.parts = None
+
+        # Anything built from the old elements..
+        self._columns = None
+        self._area_index = None
+        self._lines = {}
+
+    def overlays(self):
+        """
+        Return the PlacedOverlays on this page
+        """
+        return [i for i in self.parts or () if isinstance(i, PlacedOverlay)]
+
+    def columns(self):
+        """
+        Return the PageColumns for this page, built on first use
+        """
+        if self._columns == None:
+            self._columns = PageColumns(self.elements)
+        return self._columns
+
+    def buildLines(self, elements, delimiter=" ", tolerance=None, gap=None):
+        """
+        Group elements into Line objects in a single pass.
+
+        Elements are sorted by (y, x) once, an element joins the current line
+        if its baseline is within tolerance of the line's first baseline.
+        If gap is given, elements on a line more than gap apart (x distance
+        between neighbouring elements) are split into separate lines.
+        Lines are returned in (y, x) order.
+        """
+        tolerance = self.line_tolerance if tolerance == None else tolerance
+        gap = self.line_gap if gap == None else gap
+
+        lines = []
+
+        def addLine(lineElements):
+            if tolerance:
+                # Baselines differ so the x order needs redoing..
+                lineElements.sort(key=lambda _: _[0])
+
+            segment = [lineElements[0]]
+            for elem in lineElements[1:]:
+                if gap != None and elem[0] - segment[-1][0] > gap:
+                    lines.append(Line(segment, delimiter))
+                    segment = []
+                segment.append(elem)
+            lines.append(Line(segment, delimiter))
+
+        lineElements = None
+        for elem in sorted(elements, key=lambda _: (_[1], _[0])):
+            if lineElements and elem[1] - lineElements[0][1] <= tolerance:
+                lineElements.append(elem)
+            else:
+                if lineElements:
+                    addLine(lineElements)
+                lineElements = [elem]
+
+        if lineElements:
+            addLine(lineElements)
+
+        return lines
+
+    def getLines(self, delimiter=" ", tolerance=None, gap=None):
+        """
+        Return the Line objects for all text elements on the page.
+        Lines are cached on the page for each set of parameters.
+        """
+        key = (delimiter, self.line_tolerance if tolerance == None else tolerance, self.line_gap if gap == None else gap)
+        lines = self._lines.get(key)
+        if lines == None:
+            lines = tuple(self.buildLines((i for i in self.elements or () if i[3] != -1), delimiter, key[1], key[2]))
+            self._lines[key] = lines
+        return lines
+
+    def mergeElements(self, elements, delimiter=" ", tolerance=None, gap=None):
+        """
+        Merge all elements that are on the same Y coord.
+        Returns new list of merged elements.
+        ie.
+            (416, 3791, 0, 0, 'For'), (526, 3791, 0, 0, 'example')
+        will become:
+            (416, 3791, 0, 0, 'For example')
+
+        Baselines within tolerance of each other count as the same line
+        and gap stops elements too far apart being joined (see buildLines).
+        Both default to the page's line_tolerance and line_gap.
+        """
+        return [i.element() for i in self.buildLines(elements, delimiter, tolerance, gap)]
+
+    def getText(self, area=None, delimiter="\n", sort=True, strip=True, color=None, mergeInlineElements=False):
+        """
+        Return all text on page or in given area
+        Separated by delimiter
+
+        Area should be a tuple of (x1, y1, x2, y2)
+
+        We ignore anything with an orientation of -1 as this is an
+        I or B-Rule and those can be retrieved using getRules()
+
+        sort will sort elements by their position on the page so we
+        get text out in the correct(ish) order.
+        """
+        if not self.elements:
+            return ""
+
+        if self.columnar:
+            # Area, sort and color in one go..
+            items = self.columns().select(area=area, color=color, sort=sort)
+        else:
+            # Get elements..
+            if area != None:
+                # Already in (y, x) order if sorting..
+                items = self._areaElements(area, sort=sort)
+            else:
+                items = (i for i in self.elements if i[3] != -1)
+
+                # Sort items if needed..
+                if sort:
+                    items = sorted(items, key=lambda x: (x[1], x[0]))
+
+            # Filter by color..
+            if color != None:
+                items = (i for i in items if i[2]==color)
+
+        # Filter empty (whitespace only) elements..
+        if strip:
+            items = ((x, y, c, o, t.strip()) for x, y, c, o, t in tuple(items) if t.strip())
+
+        # Merge texts?
+        if mergeInlineElements:
+            items = self.mergeElements(items)
+
+        # Join the texts and return..
+        return delimiter.join((i[4] for i in items))
+
+    def getTextElements(self, area=None, sort=True, color=None, mergeInlineElements=False):
+        """
+        Return all text elements on page or in given area
+
+        Area should be a tuple of (x1, y1, x2, y2)
+
+        We ignore anything with an orientation of -1 as this is an
+        I or B-Rule and those can be retrieved using getRules()
+
+        sort will sort elements by their position on the page so we
+        get text out in the correct(ish) order.
+        """
+        if not self.elements:
+            return ()
+
+        if mergeInlineElements and area == None and color == None:
+            # Whole page, use the cached lines..
+            return tuple(i.element() for i in self.getLines())
+
+        if self.columnar:
+            items = self.columns().select(area=area, color=color, sort=sort)
+        elif area != None:
+            items = self._areaElements(area, sort=sort)
+        else:
+            if sort:
+                items = sorted(self.elements, key=lambda x: (x[1], x[0]))
+            else:
+                items = self.elements
+
+            items = (i for i in items if i[3] != -1)
+
+        if color != None and not self.columnar:
+            items = (i for i in items if i[2]==color)
+
+        # Merge texts?
+        if mergeInlineElements:
+            items = self.mergeElements(items)
+
+        return tuple(items)
+
+    def getRules(self, area=None, color=None):
+        """
+        Return all rules on page or in given area
+        Area should be a tuple of (x1, y1, x2, y2)
+
+        We want orientation of -1 as I or B-Rule will be set to that
+
+        Returned elements will contain a tuple instead of text value at
+        position 4 like:
+            ("I-Rule", length, width)
+        """
+        assert self.elements, "No elements!"
+        assert area == None or isinstance(area, tuple), "specified area is not a tuple in the form: (x1, y1, x2, y2)"
+
+        if self.columnar:
+            return tuple(self.columns().select(rules=True, area=area, color=color))
+
+        if area != None:
+            items = self._areaElements(area, rules=True, sort=False)
+        else:
+            items = (i for i in self.elements if i[3] == -1)
+
+        if color != None:
+            items = (i for i in items if i[2]==color)
+
+        return tuple(items)
+
+    def findTextPos(self, text, rx=True, exactMatch=False, color=None, area=None):
+        """
+        Return the position of the first match
+        """
+        results = self.findText(text, rx=rx, exactMatch=exactMatch, color=color, area=area)
+        if results:
+            return results[0][0:2]
+        return None
+
+    def findText(self, text, rx=True, exactMatch=False, color=None, area=None, mergeInlineElements=False):
+        """
+        Return the element containing given text
+        If color is specified then only text with that color will be returned.
+        """
+        if area != None and None in area:
+            return ()
+
+        if self.columnar:
+            # Only search the texts in area and with color..
+            candidates = self.columns().select(area=area, color=color)
+            color = None
+        elif area != None:
+            # Only search the texts in area..
+            candidates = self._areaElements(area, sort=False)
+        else:
+            candidates = self.elements
+
+        if rx == True:
+            search = re.compile(text).search
+
+        items = []
+        for i in candidates:
+            if i[3] == -1: # Ignore rules
+                continue
+
+            if rx == True:
+                result = search(i[4])
+                if result:
+                    if not exactMatch or (exactMatch and result.group()==i[4]):
+                        items.append(i)
+            else:
+                if (exactMatch and i[4] == text) or (not exactMatch and text in i[4]):
+                    items.append(i)
+
+        if not items:
+            return ()
+
+        # Filter by color..
+        if color != None:
+            items = (i for i in items if i[2]==color)
+
+        # Merge texts?
+        if mergeInlineElements:
+            items = self.mergeElements(items)
+
+        return tuple(items)
+
+    def findPatterns(self, patterns, color=None, area=None, limit=None):
+        """
+        Return (pattern,) + element for every pattern of PatternSet patterns
+        found in an element, checking each element once. Stops after limit
+        hits if given. patterns can also be a list of literals.
+        """
+        if not isinstance(patterns, PatternSet):
+            patterns = PatternSet(patterns)
+
+        if area != None and None in area:
+            return ()
+
+        if self.columnar:
+            candidates = self.columns().select(area=area, color=color)
+            color = None
+        elif area != None:
+            candidates = self._areaElements(area, sort=False)
+        else:
+            candidates = self.elements
+
+        items = []
+        for i in candidates:
+            if i[3] == -1 or (color != None and i[2] != color):
+                continue
+
+            for n in patterns.match(i[4]):
+                items.append((patterns.patterns[n],) + tuple(i))
+                if limit != None and len(items) >= limit:
+                    return tuple(items)
+
+        return tuple(items)
+
+class TextIndex(object):
+    """
+    Inverted index of the text elements across documents.
+
+    Every text element is split into lower-cased whitespace separated
+    tokens and each token maps to postings of (document, page, element)
+    numbers, stored flat in an array. Literal and prefix lookups are
+    answered from the index alone. findText() uses it to narrow down which
+    elements a search needs to look at: literal searches by the tokens
+    containing each word and regex searches by the literal parts of the
+    pattern. Only those elements are then checked with the real test.
+
+    getPage(doc_num, page_num) must return the Page the postings refer to.
+    """
+    def __init__(self, getPage):
+        self.getPage = getPage
+        self.postings = {} # token: array of doc, page, element triples
+        self.elements = array("L") # Doc, page, element triples of every text element
+        self._tokens = None # Sorted tokens for prefix lookups
+
+    def __len__(self):
+        return len(self.postings)
+
+    def addPage(self, doc_num, page_num, page):
+        """
+        Add the text elements of page to the index
+        """
+        postings = self.postings
+        for elem_num, elem in enumerate(page.elements or ()):
+            if elem[3] == -1: # Ignore rules
+                continue
+            self.elements.extend((doc_num, page_num, elem_num))
+            for token in set(elem[4].lower().split()):
+                entry = postings.get(token)
+                if entry == None:
+                    entry = postings[token] = array("L")
+                entry.extend((doc_num, page_num, elem_num))
+
+        self._tokens = None
+
+    def _triples(self, entries):
+        result = set()
+        for entry in entries:
+            result.update(zip(entry[0::3], entry[1::3], entry[2::3]))
+        return result
+
+    def lookup(self, token):
+        """
+        Return sorted (doc, page, element) postings of elements containing token
+        """
+        return sorted(self._triples([self.postings.get(token.lower(), ())]))
+
+    def prefix(self, prefix):
+        """
+        Return sorted (doc, page, element) postings of elements with a token
+        starting with prefix
+        """
+        if self._tokens == None:
+            self._tokens = sorted(self.postings)
+
+        prefix = prefix.lower()
+        tokens = self._tokens
+        entries = []
+        for i in range(bisect.bisect_left(tokens, prefix), len(tokens)):
+            if not tokens[i].startswith(prefix):
+                break
+            entries.append(self.postings[tokens[i]])
+
+        return sorted(self._triples(entries))
+
+    def _literals(self, text, rx):
+        """
+        Return the words that must appear (as part of a token) in any
+        element matched by text, or None if we can't tell
+        """
+        if not rx:
+            return text.lower().split()
+
+        try:
+            parsed = sre_parse.parse(text)
+        except Exception:
+            return None
+
+        # Collect runs of literals at the top level of the pattern..
+        runs = []
+        run = []
+        for op, arg in parsed:
+            if op == sre_parse.LITERAL:
+                run.append(chr(arg))
+                continue
+
+            if op == sre_parse.BRANCH:
+                return None # Alternation, nothing is required
+
+            if run:
+                runs.append("".join(run))
+                run = []
+        if run:
+            runs.append("".join(run))
+
+        return [word for run in runs for word in run.lower().split()]
+
+    def _candidates(self, words):
+        """
+        Return the set of (doc, page, element) containing every word
+        """
+        candidates = None
+        for word in sorted(words, key=len, reverse=True):
+            found = self._triples([entry for token, entry in self.postings.items() if word in token])
+            candidates = found if candidates == None else candidates & found
+            if not candidates:
+                break
+        return candidates
+
+    def findText(self, text, rx=True, exactMatch=False):
+        """
+        Return all text elements matching text like Document.findText but
+        for every document, as (doc_num, page_num) + element
+        """
+        words = self._literals(text, rx)
+        if words:
+            candidates = sorted(self._candidates(words))
+        else:
+            # Can't narrow it down so check every text element, including
+            # the empty ones which have no tokens..
+            candidates = sorted(self._triples([self.elements]))
+
+        if rx == True:
+            search = re.compile(text).search
+
+        results = []
+        page_key = page = None
+        for doc_num, page_num, elem_num in candidates:
+            if (doc_num, page_num) != page_key:
+                page_key = (doc_num, page_num)
+                page = self.getPage(doc_num, page_num)
+
+            elem = page.elements[elem_num]
+            if rx == True:
+                result = search(elem[4])
+                if result and (not exactMatch or result.group()==elem[4]):
+                    results.append((doc_num, page_num) + elem)
+            elif (exactMatch and elem[4] == text) or (not exactMatch and text in elem[4]):
+                results.append((doc_num, page_num) + elem)
+
+        return results
+
+
+class PatternSet(object):
+    """
+    Many literal and regex patterns searched for in a single pass.
+
+    Literals are matched together by an Aho-Corasick automaton, each text
+    is walked once whatever the number of literals. Regexes are compiled
+    once here. With exactMatch a pattern must match the whole text, literals
+    are then a dict lookup. ignoreCase applies to both.
+
+    match(text) returns the numbers of the patterns found in text, the
+    pattern itself is self.patterns[number] (literals first, then regexes).
+
+    Example:
+    >>> patterns = PatternSet(["Overdraft", "Arrears"], [r"APR \\d+%"])
+    >>> afp.findPatterns(patterns, limit=1)
+    """
+    def __init__(self, literals=(), regexes=(), exactMatch=False, ignoreCase=False):
+        literals = tuple(literals)
+        regexes = tuple(regexes)
+        assert literals or regexes, "No patterns given"
+        assert all(literals), "Empty literal pattern"
+
+        self.patterns = literals + regexes
+        self.exactMatch = exactMatch
+        self.ignoreCase = ignoreCase
+
+        flags = re.IGNORECASE if ignoreCase else 0
+        self.regexes = [(len(literals) + n, (re.compile(i, flags) if isinstance(i, str) else i))
+            for n, i in enumerate(regexes)]
+
+        if ignoreCase:
+            literals = tuple(i.casefold() for i in literals)
+
+        if exactMatch:
+            self.exact = {}
+            for n, i in enumerate(literals):
+                self.exact.setdefault(i, []).append(n)
+        else:
+            self._buildAutomaton(literals)
+
+    def __len__(self):
+        return len(self.patterns)
+
+    def _buildAutomaton(self, literals):
+        """
+        Build the goto, fail and output tables of the Aho-Corasick automaton
+        """
+        self.goto = [{}] # State: {char: state}, 0 is the root
+        self.out = [()] # State: pattern numbers ending there
+        for n, literal in enumerate(literals):
+            state = 0
+            for c in literal:
+                nxt = self.goto[state].get(c)
+                if nxt == None:
+                    nxt = self.goto[state][c] = len(self.goto)
+                    self.goto.append({})
+                    self.out.append(())
+                state = nxt
+            self.out[state] += (n,)
+
+        # Breadth first so every fail state is done before it's used..
+        self.fail = [0] * len(self.goto)
+        queue = list(self.goto[0].values())
+        for state in queue:
+            for c, nxt in self.goto[state].items():
+                queue.append(nxt)
+                fail = self.fail[state]
+                while fail and c not in self.goto[fail]:
+                    fail = self.fail[fail]
+                self.fail[nxt] = self.goto[fail].get(c, 0)
+                self.out[nxt] += self.out[self.fail[nxt]] # Patterns ending inside this one..
+
+    def match(self, text):
+        """
+        Return the sorted numbers of the patterns found in text
+        """
+        if self.ignoreCase:
+            literal_text = text.casefold()
+        else:
+            literal_text = text
+
+        found = set()
+        if self.exactMatch:
+            found.update(self.exact.get(literal_text, ()))
+            found.update(n for n, rx in self.regexes if rx.fullmatch(text))
+        else:
+            goto = self.goto
+            fail = self.fail
+            out = self.out
+            state = 0
+            for c in literal_text:
+                while state and c not in goto[state]:
+                    state = fail[state]
+                state = goto[state].get(c, 0)
+                if out[state]:
+                    found.update(out[state])
+            found.update(n for n, rx in self.regexes if rx.search(text))
+
+        return sorted(found)
+
+
+class AshyAFP(object):
+    """
+    Ashy's attempt to read AFP data without some shitty library
+    """
+    def __init__(self, filename=None, allow_unknown_fields=False, keep_all_resources=True, incorporateOverlays=True, use_mmap=False, page_cache_size=128, codepage=None, columnar=False, line_tolerance=0, line_gap=None, stream_images=False, collect_stats=False, use_index=False, index_file=None, compact_elements=False, zero_copy=False, include_fields=None, exclude_fields=None):
+        self.debug = False
+
+        self.data = None # Holds whole AFP file (or a FieldIndex over it when using mmap)
+        self.pages = None # Raw page fields (FieldRanges)
+        self.parsedPages = None # LazyPages over self.pages
+        self.documents = None
+        self.resources = None
+        self.structure = None # StructureNode tree of Begin/End fields
+        self.text_index = None # Optional TextIndex, see buildTextIndex()
+        self.tle_index = None # (TLE key, value): [document numbers], see findDocuments()
+        self.document_tles = None # TLE dict of every document from scanTLEs()
+        self.offsets = None # OffsetTable from scanOffsets() or scanTLEs(), see getDocument()
+
+        # Tail following, see follow() and refresh()..
+        self.follow_offset = 0
+        self.follow_finished = False
+        self._stream_resource = None
+        self._stream_document = None
+        self.overlays = {} # Parsed overlay text elements by resource name
+
+        self.page_count = 0
+        self.document_count = 0
+        self.resource_count = 0
+
+        self.unknown_field_count = 0
+        self.unhandled_functions = {} # PTOCA function code: count
+        self._lock = threading.Lock() # Guards overlays and counters when pages are parsed on threads
+
+        # Per phase timings and field/function counts, see statsInfo(). Hooks are
+        # called as func(afp, phase, seconds) when a phase ends, see addHook()..
+        self.stats = Stats() if collect_stats else None
+        self.hooks = {}
+
+        self.filename = None
+
+        self.keep_all_resources = keep_all_resources
+        self.allow_unknown_fields = allow_unknown_fields
+
+        self.incorporateOverlays = incorporateOverlays
+
+        # Keep image resources as ImageResources (streamed from the fields
+        # or mmap when used) instead of decoded bytes..
+        self.stream_images = stream_images
+
+        self.columnar = columnar # Pages use PageColumns for filtering
+        self.compact_elements = compact_elements # Elements are held in ElementArrays rather than tuples
+        self.line_tolerance = line_tolerance # Line building for merged text, see Page.buildLines
+        self.line_gap = line_gap
+
+        self.use_mmap = use_mmap
+        self._fp = None
+        self._mmap = None
+
+        # Field payloads are memoryviews of one buffer (the mmap, or the whole
+        # file read in one go) rather than a bytes object each..
+        self.zero_copy = zero_copy
+
+        # Field types to read (None for all) and not to read, see setFieldFilter()..
+        self.include_fields = None
+        self.exclude_fields = None
+        self.skipped_bytes = 0 # Payload bytes not read because of the filter
+        self.setFieldFilter(include_fields, exclude_fields)
+
+        # Sidecar index, written on the first load and used (with mmap) on
+        # later loads while the file is unchanged. See saveIndex()..
+        self.use_index = use_index
+        self.index_file = index_file # Default is the AFP filename + INDEX_SUFFIX
+        self.index_loaded = False # The last load() used the sidecar index
+
+        self.page_cache = PageCache(page_cache_size) # Shared by all LazyPages
+
+        # Code page used to decode text, if not given we use the first code page
+        # resource with a known CPGID or fall back to DEFAULT_CODEPAGE..
+        self.default_codepage = codepage
+        self._resetCodepage()
+
+        if filename != None:
+            self.load(filename)
+
+    def iterImageResources(self):
+        """
+        Yield an ImageResource for every image resource
+        """
+        for name, res in (self.resources or {}).items():
+            if isinstance(res, ImageResource):
+                yield res
+            elif isinstance(res, bytes):
+                yield ImageResource(name, [(res, 0, len(res))])
+
+    def saveImageResources(self, output_folder, workers=None):
+        """
+        Save all image resources to the output_folder
+
+        Each image is streamed to its file a segment at a time and named
+        with the extension of its real format (see ImageResource.format).
+        If workers is given the files are written by a pool of that many threads.
+        """
+        if not self.resources:
+            return 0
+
+        os.makedirs(output_folder, exist_ok=True)
+
+        def save(image):
+            with open(os.path.join(output_folder, f"{image.name}.{image.format()}"), "wb") as fp:
+                return image.writeTo(fp)
+
+        if workers:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+                list(executor.map(save, self.iterImageResources()))
+        else:
+            for image in self.iterImageResources():
+                save(image)
+
+        return len(self.resources)
+
+    def _imageSegments(self, res):
+        """
+        Return (buffer, start, end) of the image data in every SF_IPD field of res
+        """
+        if isinstance(res, FieldIndex):
+            # Point straight into the buffer..
+            ipds = [(res.buffer, res.offsets[i], res.lengths[i]) for i in range(res.start, res._stop()) if res.ids[i] == SF_IPD]
+        else:
+            ipds = [(t_dat, 0, len(t_dat)) for t_id, t_dat in res if t_id == SF_IPD]
+
+        segments = []
+        for buffer, offset, length in ipds:
+            if length < 4:
+                continue # Skipped (see exclude_fields) or empty
+            i_id, i_len = struct.unpack_from(">HH", buffer, offset)
+            if i_id == 0xFE92 and i_len: # Image Data header
+                segments.append((buffer, offset+4, offset+min(4+i_len, length)))
+
+        return segments
+
+    def _getResources(self, ranges=None):
+        """
+        Parse every resource into self.resources, keyed by resource name.
+        Images are their bytes (any format) or ImageResource objects with
+        stream_images, overlays keep their fields. Returns the resource count.
+
+        ranges is an optional list of (start, end) field positions of the
+        resources (from the sidecar index) so the tree isn't searched.
+        """
+        assert self.data, "No data loaded"
+
+        self.resources = {}
+
+        if ranges == None:
+            if self.structure == None:
+                self.structure = self._buildStructure()
+            ranges = [(node.start, node.end) for node in self.structure.find(SF_BRS)]
+
+        for start, end in ranges:
+            self._parseResource(self.data[start:end+1])
+
+        return len(self.resources)
+
+    def _parseResource(self, res):
+        """
+        Add a single resource (list of fields from SF_BRS to SF_ERS) to self.resources
+        """
+        # Get the resource name from the first entry (which is the BRS field)..
+        res_name = self.toASCII(res[0][1][0:8])
+
+        # Code page, take the decoding code page from it if we can..
+        if self.codepage_from_resources:
+            result = [t_dat for t_id, t_dat in res if t_id == SF_CPD]
+            if result and len(result[0]) >= 42:
+                if self.setCodepage(cpgid=int.from_bytes(result[0][40:42], byteorder="big")):
+                    self.codepage_from_resources = False # Only the first one is used
+
+        # Image objects..
+        if SF_IPD in self._fieldIds(res):
+            segments = self._imageSegments(res)
+            if segments:
+                image = ImageResource(res_name, segments)
+                self.resources[res_name] = image if self.stream_images else image.read()
+            else:
+                # Text element in the object..
+                result = [t_dat for t_id, t_dat in res if t_id == SF_PTX]
+                if result:
+                    self.resources[res_name] = self._parsePTOCAdat(result[0])
+        else:
+            # Overlays (and everything else) keep their fields, overlay text
+            # is parsed once when it is first included (see _getOverlay)
+            self.resources[res_name] = res
+
+        return res_name
+
+    def countFields(self, field_type, data=None):
+        """
+        Return how many of this field_type there is in data
+        """
+        if not data and self.data:
+            data = self.data
+        assert data, "No data loaded"
+        return self._fieldIds(data).count(field_type)
+
+    def _fieldIds(self, data):
+        """
+        Return just the field ids of data without touching any payloads
+        """
+        if isinstance(data, FieldIndex):
+            return data.fieldIds()
+        return [i[0] for i in data]
+
+    def toASCII(self, ebcdic_text):
+        """
+        Convert EBCDIC encoded text to ASCII
+
+        Example:
+        >>> text = b'\xc3\xa4\xa2\xa3\x96\x94\x85\x99\xc9\x95\xd9\xa4\x95'
         >>> self.toASCII(text)
         'CustomerInRun'
 
         """
-        return codecs.decode(ebcdic_text, "EBCDIC-CP-BE")
+        return codecs.charmap_decode(ebcdic_text, "strict", self._decoding_tables[0])[0]
+
+    def setCodepage(self, codepage=None, cpgid=None):
+        """
+        Select the code page used to decode text (a python codec name),
+        or give a Code Page Global ID (cpgid) as found in the SF_CPD field.
+        Returns True if the code page was changed.
+        """
+        if cpgid != None:
+            codepage = afp_codepages.get(cpgid)
+            if codepage == None:
+                return False # Unknown (or user defined) code page
+
+        self.codepage = codepage or DEFAULT_CODEPAGE
+        self._decoding_tables = _getDecodingTables(self.codepage)
+        return True
+
+    def _resetCodepage(self):
+        """
+        Go back to the code page given to __init__ for a new file, if none
+        was given the new file's code page resource is used again
+        """
+        self.codepage_from_resources = self.default_codepage == None
+        self.setCodepage(self.default_codepage)
+
+    def _parseTLEs(self, tle_data):
+        """
+        Parse the TLE information and create a dict
+
+        Example:
+        >>> testdata = (35, 13869200, b'\x11\x02\x0b\x00\xc3\xa4\xa2\xa3\x96\x94\x85\x99\xc9\x95\xd9\xa4\x95\t6\x00\x00\xf0\xf0\xf1\xf2\xf2')
+        >>> self._parseTLEs(testdata)
+        {"CustomerInRun": "00122"}
+
+        """
+        assert tle_data, "No data"
+
+        TLEs = {}
+
+        for t_id, t_dat in tle_data:
+            offset = 0
+            key = None
+            value = None
+            while offset < len(t_dat):
+                # get triplet..
+                # t_len, t_id, t_dat = struct.unpack_from(f"BB{t_dat[0]-2}s", t_dat, offset=offset)
+                tle_length = t_dat[offset]
+                tle_code = t_dat[offset+1]
+                data = t_dat[offset+2:offset+tle_length]
+                offset += tle_length
+
+                if tle_code == 0x02: # Fully Qualified Name
+                    key = self.toASCII(data[2:2+tle_length])
+
+                elif tle_code == 0x36: # Attribute Value
+                    value = self.toASCII(data[2:2+tle_length])
+
+                # Add to dict..
+                if key and value:
+                    TLEs[key] = value
+
+        return TLEs
+
+    def _getDocuments(self, tles=None):
+        """
+        Get all documents (Named Page Groups)
+
+        tles is an optional list of already parsed TLE dicts (from the
+        sidecar index), one per document.
+        """
+        assert self.data, "No data loaded"
+
+        if self.structure == None:
+            self.structure = self._buildStructure()
+
+        # Named Page Groups, each is built when it is first used..
+        tree = self.structure.tree
+        nodes = tree.findNumbers(SF_BNG)
+        data = self.data
+
+        def build(doc_num):
+            return self._buildDocument(StructureNode(tree, nodes[doc_num]), data, tles[doc_num] if tles != None else None)
+
+        self.documents = LazyDocuments(len(nodes), build)
+        return len(self.documents)
+
+    def _buildDocument(self, node, data, tles=None):
+        """
+        Create a Document from a Named Page Group node of the structure tree
+        """
+        if tles == None:
+            indexes = node.tleIndexes()
+            tles = self._parseTLEs([data[i] for i in indexes]) if indexes else {}
+        pages = LazyPages(FieldRanges(data, *node.tree.ranges(SF_BPG, node.num)), self.parsePage, self.page_cache)
+
+        return Document(pages=pages, tle=tles)
+
+    def _buildStructure(self, data=None):
+        """
+        Build the Begin/End nesting tree in a single pass over the field ids.
+        Returns the root StructureNode, every node records the index range
+        of its fields so groups, pages and objects can be sliced from data
+        without scanning it again.
+        """
+        if not data and self.data:
+            data = self.data
+        assert data, "No data loaded"
+
+        tree = StructureTree()
+        ids, starts, ends, parents = tree.ids, tree.starts, tree.ends, tree.parents
+        tles = []
+
+        # The root..
+        ids.append(0)
+        starts.append(0)
+        ends.append(0)
+        parents.append(-1)
+        stack = [0] # Open node numbers
+
+        for i, f_id in enumerate(self._fieldIds(data)):
+            if f_id >> 16 != 0xd3:
+                continue
+
+            f_type = (f_id >> 8) & 0xff
+            if f_type == 0xa8:
+                # Begin field
+                parents.append(stack[-1])
+                stack.append(len(ids))
+                ids.append(f_id)
+                starts.append(i)
+                ends.append(i)
+
+            elif f_type == 0xa9:
+                # End field, close up to the matching begin (if any)..
+                begin = f_id - 0x100
+                if any(ids[n] == begin for n in stack):
+                    while ids[stack[-1]] != begin:
+                        ends[stack.pop()] = i-1 # Begin without an end
+                    ends[stack.pop()] = i
+
+            elif f_id == SF_TLE:
+                tles.append((stack[-1], i))
+
+        # Ensure we have not finished in the middle of a block..
+        assert len(stack) == 1, f"{hex(ids[stack[-1]])} but no {hex(ids[stack[-1]] + 0x100)}"
+
+        ends[0] = len(data) - 1
+
+        # TLEs after a child closes come later than the child's, sort by node..
+        for num, i in sorted(tles):
+            tree.tle_nodes.append(num)
+            tree.tle_fields.append(i)
+
+        return StructureNode(tree)
+
+    def iterDocuments(self, filename=None):
+        """
+        Generator that reads the file sequentially and yields one Document
+        at a time as soon as its Named Page Group (SF_BNG..SF_ENG) closes.
+
+        Only the fields of the current group are held in memory so this can
+        be used on spools of any size. Resources found along the way (ie. the
+        leading SF_BRG group) are added to self.resources so overlays resolve,
+        those of any earlier file are dropped first.
+
+        Files without Named Page Groups yield nothing, use load() for those.
+
+        Example:
+        >>> for doc in AshyAFP().iterDocuments("statements.afp"):
+        ...     print(doc.tle, len(doc.pages))
+        """
+        if filename != None:
+            self.filename = filename
+        assert self.filename, "No filename given"
+
+        # Nothing from an earlier file may be reused..
+        self.resources = {}
+        self.overlays = {}
+        self.page_cache.clear()
+        self._resetCodepage()
+
+        with open(self.filename, "rb") as fp:
+            yield from self._streamDocuments(fp)
+
+    def _streamDocuments(self, fp):
+        """
+        Read fields from fp and yield a Document for every Named Page Group
+        """
+        if self.resources == None:
+            self.resources = {}
+
+        self._stream_resource = None
+        self._stream_document = None
+
+        for field in self._readFields(fp):
+            document = self._streamField(field)
+            if document != None:
+                yield document
+
+        # Ensure we have not finished in the middle of a block..
+        assert self._stream_resource == None, f"{hex(SF_BRS)} but no {hex(SF_ERS)}"
+        assert self._stream_document == None, f"{hex(SF_BNG)} but no {hex(SF_ENG)}"
+
+    def _streamField(self, field):
+        """
+        Collect a field read in file order. Resources are parsed when their
+        SF_ERS arrives, returns the Document when a Named Page Group closes.
+        """
+        f_id = field[0]
+
+        # Resources..
+        if f_id == SF_BRS:
+            self._stream_resource = [field]
+        elif self._stream_resource != None:
+            self._stream_resource.append(field)
+            if f_id == SF_ERS:
+                self._parseResource(self._stream_resource)
+                self.resource_count = len(self.resources)
+                self._stream_resource = None
+
+        # Named Page Groups..
+        if f_id == SF_BNG:
+            self._stream_document = [field]
+        elif self._stream_document != None:
+            self._stream_document.append(field)
+            if f_id == SF_ENG:
+                document = self._stream_document
+                self._stream_document = None
+                return self._buildDocument(self._buildStructure(document).children[0], document)
+
+        return None
+
+    def follow(self, filename):
+        """
+        Start following filename, a spool that may still be being written.
+        Nothing is read until refresh() is called.
+
+        Example:
+        >>> afp = AshyAFP()
+        >>> afp.follow("spool.afp")
+        >>> while True:
+        ...     for doc in afp.refresh():
+        ...         print(doc.tle)
+        ...     time.sleep(1)
+        """
+        self.close()
+        self.filename = filename
+        self.data = None
+        self.structure = None
+        self.resources = {}
+        self.overlays = {}
+        self.page_cache.clear()
+        self._resetCodepage()
+        self.documents = []
+        self.pages = self.parsedPages = None
+        self.document_count = self.resource_count = self.page_count = 0
+        self.tle_index = self.document_tles = self.offsets = None
+        self.text_index = None
+
+        self.follow_offset = 0 # End of the last complete field read
+        self.follow_finished = False # End Document read
+        self._stream_resource = None
+        self._stream_document = None
+
+    def refresh(self):
+        """
+        Read the complete fields appended since the last refresh and return
+        a list of the documents completed by them, which are also added to
+        self.documents. A partial field at the end of the file is left for
+        a later refresh.
+        """
+        assert self.filename and self.documents != None, "Not following, call follow() first"
+
+        with open(self.filename, "rb") as fp:
+            size = os.fstat(fp.fileno()).st_size
+            assert size >= self.follow_offset, f"{self.filename!r} has shrunk, was it replaced?"
+            fp.seek(self.follow_offset)
+            data = fp.read(size - self.follow_offset)
+
+        unpack_from = SF_HEADER.unpack_from
+        filtering = self._filtering()
+        documents = []
+
+        offset = 0
+        while offset + SF_HEADER_SIZE <= len(data):
+            sf_ccc, sf_len, sf_id_hi, sf_id_lo = unpack_from(data, offset)
+            assert sf_ccc == 0x5A, "Carriage control char missing"
+
+            # length does not take into account the CARRIAGE_CONTROL_CHAR so add one..
+            end = offset + sf_len + 1
+            if end > len(data):
+                break # Not all written yet
+
+            sf_id = (sf_id_hi << 16) | sf_id_lo
+            self._checkField(sf_id, self.follow_offset + offset)
+
+            if filtering and self._skipField(sf_id):
+                field = (sf_id, b"")
+            else:
+                field = (sf_id, data[offset+SF_HEADER_SIZE:end])
+
+            if sf_id == SF_EDT and self._stream_document == None:
+                self.follow_finished = True
+
+            document = self._streamField(field)
+            if document != None:
+                documents.append(document)
+            offset = end
+
+        self.follow_offset += offset
+
+        if documents:
+            self.documents.extend(documents)
+            self.document_count = len(self.documents)
+            self.tle_index = None # Rebuilt with the new documents on the next findDocuments
+
+        return documents
+
+    def followDocuments(self, filename, interval=1.0, idle=None):
+        """
+        Generator following filename, yielding documents as soon as they are
+        complete. The file is checked every interval seconds. Stops once the
+        End Document field has been read, or after idle seconds without any
+        new complete fields (None to wait for ever).
+        """
+        self.follow(filename)
+
+        last_change = time.monotonic()
+        while True:
+            offset = self.follow_offset
+            yield from self.refresh()
+
+            if self.follow_offset != offset:
+                last_change = time.monotonic()
+            if self.follow_finished:
+                break
+            if idle != None and time.monotonic() - last_change >= idle:
+                break
+
+            time.sleep(interval)
+
+    def _readRange(self, fp, begin, end):
+        """
+        Return the fields in bytes begin..end of fp (must be field aligned)
+        """
+        fp.seek(begin)
+        return list(self._readFields(io.BytesIO(fp.read(end-begin))))
+
+    @classmethod
+    def mapDocuments(cls, filename, func=None, workers=None, docs_per_shard=None, **options):
+        """
+        Parse the documents (Named Page Groups) of filename in a process pool
+        and yield func(document) for every document, in document order.
+
+        The file is indexed once here and split into byte ranges that start
+        at an SF_BNG and end at an SF_ENG. Each worker reopens the file by
+        path, parses the resource fields once (so overlays resolve) and then
+        the documents in every range it is given. Shards hold at most
+        docs_per_shard (default up to MAP_SHARD_SIZE) documents and only two
+        per worker are in flight, so memory doesn't grow with the file.
+
+        func must be picklable (ie. a module level function), if it is None
+        the Document itself is returned with all its pages parsed.
+        Any other keyword options are passed on to AshyAFP() in the workers.
+
+        Example:
+        >>> def getAccount(doc):
+        ...     return doc.tle.get("CustomerInRun"), doc.getText()
+        >>> for account, text in AshyAFP.mapDocuments("big.afp", getAccount, workers=48):
+        ...     pass
+        """
+        workers = workers or os.cpu_count() or 1
+
+        # Find the resource and document byte ranges..
+        afp = cls(**options)
+        try:
+            afp.data = afp._mapFile(filename)
+            if not afp.data:
+                return
+            structure = afp._buildStructure()
+
+            res_ranges = [afp.data.byteRange(i.start, i.end) for i in structure.find(SF_BRS)]
+            doc_ranges = [afp.data.byteRange(i.start, i.end) for i in structure.find(SF_BNG)]
+        finally:
+            afp.data = None
+            afp.close()
+
+        if not doc_ranges:
+            return
+
+        # Split into shards of consecutive documents..
+        if not docs_per_shard:
+            docs_per_shard = max(1, min(MAP_SHARD_SIZE, -(-len(doc_ranges) // (workers * 4))))
+
+        shards = []
+        for i in range(0, len(doc_ranges), docs_per_shard):
+            group = doc_ranges[i:i+docs_per_shard]
+            shards.append((group[0][0], group[-1][1]))
+
+        # At most two shards per worker are in flight so finished ones don't
+        # pile up here when the consumer is slower than the pool..
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=_parallelInit,
+                initargs=(cls, filename, res_ranges, options)) as executor:
+            for results in _orderedResults(executor, _parallelShard, ((shard, func) for shard in shards), workers * 2):
+                yield from results
+
+    @classmethod
+    async def openAsync(cls, filename, executor=None, semaphore=None, **options):
+        """
+        Load filename without blocking the event loop, returns the AshyAFP.
+
+        The load runs on executor (a thread pool, None is the loop's default
+        executor). If semaphore (an asyncio.Semaphore) is given it is held
+        while loading, so it can bound how many files load at once. Any other
+        keyword options are passed on to AshyAFP().
+
+        Cancelling the await stops waiting straight away, the load itself
+        finishes in its thread and is then thrown away.
+
+        Example:
+        >>> afp = await AshyAFP.openAsync("statements.afp", use_mmap=True)
+        """
+        loop = asyncio.get_running_loop()
+        async with semaphore or contextlib.nullcontext():
+            return await loop.run_in_executor(executor, functools.partial(cls, filename, **options))
+
+    @classmethod
+    async def openManyAsync(cls, filenames, limit=4, executor=None, **options):
+        """
+        Async generator loading filenames concurrently, at most limit at a
+        time, and yielding (filename, AshyAFP) as each one finishes. Loads
+        still pending are cancelled if the generator is closed or cancelled.
+
+        Example:
+        >>> async for filename, afp in AshyAFP.openManyAsync(paths, limit=8):
+        ...     print(filename, afp.document_count)
+        """
+        semaphore = asyncio.Semaphore(limit)
+
+        async def load(filename):
+            return filename, await cls.openAsync(filename, executor, semaphore, **options)
+
+        tasks = [asyncio.ensure_future(load(i)) for i in filenames]
+        try:
+            for task in asyncio.as_completed(tasks):
+                yield await task
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def iterDocumentsAsync(self, executor=None):
+        """
+        Async generator yielding every document with all of its pages parsed,
+        the parsing runs on executor (a thread pool, None is the loop's
+        default executor) one document at a time. Several consumers may
+        iterate the same instance, the page cache, overlays and counters
+        they share are locked.
+        """
+        loop = asyncio.get_running_loop()
+        for doc in self.documents or ():
+            yield await loop.run_in_executor(executor, self._parsedDocument, doc)
+
+    async def iterPagesAsync(self, executor=None):
+        """
+        Async generator yielding (doc_num, page_num, page) for every page,
+        doc_num is 0 when the file has no documents. Each page is parsed on
+        executor (a thread pool, None is the loop's default executor), see
+        iterDocumentsAsync.
+        """
+        loop = asyncio.get_running_loop()
+        if self.documents:
+            sequences = enumerate(doc.pages for doc in self.documents)
+        else:
+            sequences = enumerate((self.parsedPages or (),))
+
+        for doc_num, pages in sequences:
+            for page_num in range(len(pages)):
+                yield doc_num, page_num, await loop.run_in_executor(executor, pages.__getitem__, page_num)
+
+    def _parsedDocument(self, doc):
+        """
+        Return a copy of doc with all of its pages parsed
+        """
+        return Document(pages=list(doc.pages), tle=doc.tle)
+
+    def _getPages(self):
+        """
+        Get all pages from afp data
+        """
+        assert self.data, "No data loaded"
+
+        if self.structure == None:
+            self.structure = self._buildStructure()
+
+        self.pages = FieldRanges(self.data, *self.structure.tree.ranges(SF_BPG))
+        self.parsedPages = LazyPages(self.pages, self.parsePage, self.page_cache)
+        return len(self.pages)
+
+    def _getPage(self, doc_num, page_num):
+        """
+        Return a parsed page, doc_num is ignored if we have no documents
+        """
+        if self.documents:
+            return self.documents[doc_num].pages[page_num]
+        return self.parsedPages[page_num]
+
+    def buildTextIndex(self):
+        """
+        Build a TextIndex over every text element of every document (or of
+        every page, as document 0, when the file has no documents).
+        Pages are parsed through the page cache, only postings are kept.
+        """
+        self.text_index = TextIndex(self._getPage)
+
+        if self.documents:
+            for doc_num, doc in enumerate(self.documents):
+                for page_num, page in enumerate(doc.pages):
+                    self.text_index.addPage(doc_num, page_num, page)
+        elif self.parsedPages:
+            for page_num, page in enumerate(self.parsedPages):
+                self.text_index.addPage(0, page_num, page)
+
+        return len(self.text_index)
+
+    def _scanHeaders(self, fp, wanted=(), check=True):
+        """
+        Generator reading only the structured field headers of fp, yields
+        (id, begin, end, data) with the field's byte range. Payloads are only
+        read for field ids in wanted, the rest are skipped (data is None).
+        check is False for files already checked for unknown fields.
+        """
+        unpack = SF_HEADER.unpack
+        offset = 0
+
+        while True:
+            header = fp.read(SF_HEADER_SIZE)
+            if not header:
+                break # End of file
+            assert len(header) == SF_HEADER_SIZE, f"Field at {offset} is truncated"
+
+            sf_ccc, sf_len, sf_id_hi, sf_id_lo = unpack(header)
+            assert sf_ccc == 0x5A, "Carriage control char missing"
+
+            sf_id = (sf_id_hi << 16) | sf_id_lo
+            if check:
+                self._checkField(sf_id, offset)
+
+            # length does not take into account the CARRIAGE_CONTROL_CHAR so add one..
+            length = sf_len + 1 - SF_HEADER_SIZE
+            if sf_id in wanted:
+                data = fp.read(length)
+            else:
+                data = None
+                fp.seek(length, io.SEEK_CUR)
+
+            yield (sf_id, offset, offset + SF_HEADER_SIZE + length, data)
+            offset += SF_HEADER_SIZE + length
+
+    def _scanFile(self, tles=False, use_index=None):
+        """
+        Header-only scan of self.filename, sets self.offsets (and
+        self.document_tles if tles, only the SF_TLE payloads are read for
+        those). With use_index (default self.use_index) the results are
+        kept in an OFFSETS_SUFFIX sidecar and reused while the file is unchanged.
+        """
+        assert self.filename, "No filename given"
+
+        use_index = self.use_index if use_index == None else use_index
+        sidecar = self.filename + OFFSETS_SUFFIX
+
+        # Nothing loaded from an earlier file may be used..
+        self.close()
+        self.data = self.structure = None
+        self.pages = self.parsedPages = None
+        self.text_index = self.tle_index = None
+
+        self.resources = None # Parsed when the first document or page is built
+        self.documents = None # Built from their byte ranges
+        self.overlays = {}
+        self.page_cache.clear() # Offset table pages are cached by number
+        self._resetCodepage()
+
+        if use_index:
+            result = self._readSidecar(sidecar, self.filename, ("resources", "tles"))
+            if result != None and (result[0]["tles"] != None or not tles):
+                header, arrays = result
+                self.offsets = OffsetTable.fromArrays(header["resources"], arrays)
+                self.document_tles = header["tles"]
+                return
+
+        offsets = OffsetTable()
+        document_tles = [] if tles else None
+
+        resource = None
+        document = None
+        page = None
+        first_page = 0
+        tle_fields = None
+        depth = 0 # Named Page Groups within groups belong to the outer one
+
+        with open(self.filename, "rb") as fp:
+            for f_id, begin, end, data in self._scanHeaders(fp, (SF_TLE,) if tles else ()):
+                if f_id == SF_BRS:
+                    resource = begin
+                elif f_id == SF_ERS and resource != None:
+                    offsets.resources.append((resource, end))
+                    resource = None
+
+                elif f_id == SF_BPG:
+                    page = begin
+                elif f_id == SF_EPG and page != None:
+                    offsets.addPage(page, end)
+                    page = None
+
+                elif f_id == SF_BNG:
+                    if not depth:
+                        document = begin
+                        first_page = offsets.pageCount()
+                        tle_fields = []
+                    depth += 1
+                elif f_id == SF_TLE and depth and tles:
+                    tle_fields.append((f_id, data))
+                elif f_id == SF_ENG and depth:
+                    depth -= 1
+                    if not depth:
+                        offsets.addDocument(document, end, first_page)
+                        if tles:
+                            document_tles.append(self._parseTLEs(tle_fields) if tle_fields else {})
+
+        # Ensure we have not finished in the middle of a block..
+        assert resource == None, f"{hex(SF_BRS)} but no {hex(SF_ERS)}"
+        assert page == None, f"{hex(SF_BPG)} but no {hex(SF_EPG)}"
+        assert not depth, f"{hex(SF_BNG)} but no {hex(SF_ENG)}"
+
+        self.offsets = offsets
+        self.document_tles = document_tles
+
+        if use_index:
+            try:
+                self._writeSidecar(sidecar, {"resources": offsets.resources, "tles": document_tles}, offsets.arrays())
+            except OSError:
+                pass # ie. a read-only archive, carry on without the sidecar
+
+    def scanOffsets(self, filename=None, use_index=None):
+        """
+        Header-only scan of filename (or the loaded file) for the byte ranges
+        of every resource, document and page (self.offsets). No payloads
+        are read. getDocument() and getPage() then read and parse just the
+        byte range asked for.
+
+        With use_index (default self.use_index) the table is saved next to
+        the file and later scans of the unchanged file just read it back.
+
+        Returns the number of documents (Named Page Groups).
+
+        Example:
+        >>> afp = AshyAFP(use_index=True)
+        >>> afp.scanOffsets("archive.afp")
+        >>> doc = afp.getDocument(500000)
+        """
+        if filename != None:
+            self.filename = filename
+
+        self._scanFile(use_index=use_index)
+        self.document_count = self.offsets.documentCount()
+        self.page_count = self.offsets.pageCount()
+        return self.document_count
+
+    def scanTLEs(self, filename=None, use_index=None):
+        """
+        TLE-only scan of filename (or the loaded file). Only the field
+        headers are read, apart from the SF_TLE payloads, page data is
+        skipped. Sets document_tles, the offset table (see scanOffsets) and
+        the tle_index used by findDocuments(), documents are then only read
+        and parsed when they are found.
+
+        Returns the number of documents (Named Page Groups).
+
+        Example:
+        >>> afp = AshyAFP()
+        >>> afp.scanTLEs("statements.afp")
+        >>> doc = afp.findDocuments(CustomerInRun="00122")[0]
+        """
+        if filename != None:
+            self.filename = filename
+
+        self._scanFile(tles=True, use_index=use_index)
+        self.buildTLEIndex(self.document_tles)
+        self.document_count = self.offsets.documentCount()
+        self.page_count = self.offsets.pageCount()
+        return self.document_count
+
+    def buildTLEIndex(self, tles=None):
+        """
+        Build tle_index from a list of TLE dicts (one per document), by
+        default the TLEs of the loaded documents
+        """
+        if tles == None:
+            tles = [doc.tle for doc in self.documents or ()]
+
+        self.tle_index = {}
+        for doc_num, doc_tles in enumerate(tles):
+            for item in doc_tles.items():
+                self.tle_index.setdefault(item, []).append(doc_num)
+
+        return len(self.tle_index)
+
+    def _offsetResources(self, fp):
+        """
+        Parse the resources from their byte ranges in the offset table, once
+        """
+        if self.resources == None:
+            self.resources = {}
+            for begin, end in self.offsets.resources:
+                self._parseResource(self._readRange(fp, begin, end))
+            self.resource_count = len(self.resources)
+
+    def _offsetDocument(self, doc_num):
+        """
+        Read and build document doc_num from its byte range in the offset table
+        """
+        with open(self.filename, "rb") as fp:
+            self._offsetResources(fp)
+            fields = self._readRange(fp, *self.offsets.documentRange(doc_num))
 
-    def _parseTLEs(self, tle_data):
+        tles = self.document_tles[doc_num] if self.document_tles != None else None
+        return self._buildDocument(self._buildStructure(fields).children[0], fields, tles)
+
+    def _offsetPage(self, number):
         """
-        Parse the TLE information and create a dict
+        Read and parse file wide page number from its byte range in the offset table
+        """
+        with open(self.filename, "rb") as fp:
+            self._offsetResources(fp)
+            fields = self._readRange(fp, *self.offsets.pageRange(number))
+
+        return self.parsePage(fields)
+
+    def getDocument(self, doc_num):
+        """
+        Return document doc_num, or a list of documents for a slice.
+
+        If the file has been loaded this is self.documents[doc_num].
+        Otherwise the offset table (see scanOffsets, scanned on first use)
+        gives the document's byte range and only that is read and parsed.
 
         Example:
-        >>> testdata = (35, 13869200, b'\x11\x02\x0b\x00\xc3\xa4\xa2\xa3\x96\x94\x85\x99\xc9\x95\xd9\xa4\x95\t6\x00\x00\xf0\xf0\xf1\xf2\xf2')
-        >>> self._parseTLEs(testdata)
-        {"CustomerInRun": "00122"}
+        >>> afp = AshyAFP()
+        >>> afp.filename = "archive.afp"
+        >>> afp.getDocument(500000).getText()
+        >>> afp.getDocument(slice(10, 20))
+        """
+        if self.offsets == None and self.documents != None:
+            return self.documents[doc_num]
+
+        if self.offsets == None:
+            self.scanOffsets()
 
+        if isinstance(doc_num, slice):
+            return [self._offsetDocument(i) for i in range(*doc_num.indices(self.offsets.documentCount()))]
+
+        if doc_num < 0:
+            doc_num += self.offsets.documentCount()
+        if doc_num < 0 or doc_num >= self.offsets.documentCount():
+            raise IndexError("document number out of range")
+
+        return self._offsetDocument(doc_num)
+
+    def getPage(self, doc_num, page_num):
         """
-        assert tle_data, "No data"
+        Return page page_num of document doc_num, or a list of pages for a
+        slice. doc_num is ignored if the file has no documents.
 
-        TLEs = {}
+        If the file has been loaded the page comes from the loaded documents
+        (or pages). Otherwise the offset table (see scanOffsets, scanned on
+        first use) gives the page's byte range and only that is read and
+        parsed, through the page cache.
+        """
+        if self.offsets == None and (self.documents or self.parsedPages != None):
+            return self._getPage(doc_num, page_num)
 
-        for t_id, t_dat in tle_data:
-            offset = 0
-            key = None
-            value = None
-            while offset < len(t_dat):
-                # get triplet..
-                # t_len, t_id, t_dat = struct.unpack_from(f"BB{t_dat[0]-2}s", t_dat, offset=offset)
-                tle_length = t_dat[offset]
-                tle_code = t_dat[offset+1]
-                data = t_dat[offset+2:offset+tle_length]
-                offset += tle_length
+        if self.offsets == None:
+            self.scanOffsets()
 
-                if tle_code == 0x02: # Fully Qualified Name
-                    key = self.toASCII(data[2:2+tle_length])
+        if not self.offsets.documentCount():
+            doc_num = None
 
-                elif tle_code == 0x36: # Attribute Value
-                    value = self.toASCII(data[2:2+tle_length])
+        if isinstance(page_num, slice):
+            numbers = range(*page_num.indices(self.offsets.pageCount(doc_num)))
+        else:
+            numbers = (page_num,)
 
-                # Add to dict..
-                if key and value:
-                    TLEs[key] = value
+        pages = []
+        for i in numbers:
+            number = self.offsets.pageNumber(doc_num, i)
+            pages.append(self.page_cache.get(("offsets", number), self._offsetPage, number))
 
-        return TLEs
+        return pages if isinstance(page_num, slice) else pages[0]
 
-    def _getDocuments(self):
+    def findDocuments(self, match=None, **tles):
         """
-        Get all documents (Named Page Groups)
+        Return the documents having all of the given TLE key/values, from
+        the match dict and/or keywords. Uses tle_index (built on first use
+        from the loaded documents, or by scanTLEs()) so only the documents
+        found are ever parsed.
+
+        Example:
+        >>> afp.findDocuments(CustomerInRun="00122")
+        >>> afp.findDocuments({"Account Number": "123456"})
         """
-        assert self.data, "No data loaded"
+        tles = dict(match or {}, **tles)
+        assert tles, "No TLEs given"
 
-        # Init documents..
-        self.documents = []
+        if self.tle_index == None:
+            self.buildTLEIndex()
 
-        # Get Named-Page groups..
-        result = self._getFieldsBetween(SF_BNG, SF_ENG)
+        found = None
+        for item in tles.items():
+            docs = self.tle_index.get(item, ())
+            found = set(docs) if found == None else found.intersection(docs)
+            if not found:
+                return []
 
-        # Loop through groups..
-        for doc_num, doc in enumerate(result):
-            tles = self._parseTLEs([i for i in doc if i[0] == SF_TLE])
-            rawpages = self._getFieldsBetween(SF_BPG, SF_EPG, data=doc)
-            pages = [self.parsePage(i) for i in rawpages]
+        if self.documents != None:
+            return [self.documents[i] for i in sorted(found)]
+        return [self._offsetDocument(i) for i in sorted(found)]
 
-            self.documents.append(Document(pages=pages, tle=tles))
+    def findText(self, text, rx=True, exactMatch=False):
+        """
+        Return all instances of text in all documents as (doc_num, page_num) + element.
+        Uses the text index if buildTextIndex() has been called. After
+        scanOffsets() documents are read from the offset table one at a time.
+        """
+        if self.text_index != None:
+            return self.text_index.findText(text, rx=rx, exactMatch=exactMatch)
 
-        return len(self.documents)
+        results = []
+        if self.documents:
+            for doc_num, doc in enumerate(self.documents):
+                results.extend((doc_num,) + i for i in doc.findText(text, rx=rx, exactMatch=exactMatch))
+        elif self.offsets != None and self.offsets.pageCount():
+            for doc_num in range(self.offsets.documentCount() or 1):
+                pages = self.getPage(doc_num, slice(None))
+                results.extend((doc_num, page_num) + i for page_num, page in enumerate(pages)
+                    for i in page.findText(text, rx=rx, exactMatch=exactMatch))
+        elif self.parsedPages:
+            for page_num, page in enumerate(self.parsedPages):
+                results.extend((0, page_num) + i for i in page.findText(text, rx=rx, exactMatch=exactMatch))
 
-    def _getFieldsBetween(self, start, end, data=None):
-        if not data and self.data:
-            data = self.data
-        assert data, "No data loaded"
+        return results
 
-        # Init..
-        collections = []
-        collection = None
+    def findPatterns(self, patterns, limit=None, first=False):
+        """
+        Search every document for many patterns at once, see PatternSet.
+        Returns (doc_num, page_num, pattern) + element for every hit.
 
-        # Loop through every field in data lookinf for start and end fields..
-        for field in data:
-            if field[0] == start:
-                # Begin field
-                collection = [field]
+        limit stops searching a document after that many hits and first
+        stops the whole search at the first hit, pages (and with an offset
+        table documents) after that are not parsed.
 
-            elif field[0] == end:
-                # End field
-                collection.append(field)
-                collections.append(collection)
-                collection = None
+        Example:
+        >>> keywords = PatternSet(open("keywords.txt").read().split("\n"), ignoreCase=True)
+        >>> afp.findPatterns(keywords, limit=1) # First keyword hit of each document
+        """
+        if not isinstance(patterns, PatternSet):
+            patterns = PatternSet(patterns)
+        if first:
+            limit = 1
+
+        if self.documents:
+            documents = enumerate(self.documents)
+        elif self.offsets != None and self.offsets.documentCount():
+            documents = ((i, self._offsetDocument(i)) for i in range(self.offsets.documentCount()))
+        elif self.parsedPages:
+            documents = ((0, Document(pages=self.parsedPages)),)
+        else:
+            documents = ()
 
-            else:
-                # Some other field
-                if collection != None:
-                    # It is between start and end so add it to collection..
-                    collection.append(field)
+        results = []
+        for doc_num, doc in documents:
+            results.extend((doc_num,) + i for i in doc.findPatterns(patterns, limit=limit))
+            if first and results:
+                break
 
-        # Ensure we have not finished in the middle of a block..
-        assert collection == None, f"{hex(start)} but no {hex(end)}"
+        return results
 
-        return tuple(collections)
+    def addHook(self, phase, func):
+        """
+        Call func(afp, phase, seconds) every time phase ends, phase is one of
+        Stats.PHASES or None for all of them. "pages" is called for every
+        page parsed. Phases are only timed when stats are on or hooks are set.
 
-    def _getPages(self):
+        Example:
+        >>> afp = AshyAFP()
+        >>> afp.addHook(None, lambda a, phase, seconds: metrics.timing(f"afp.{phase}", seconds))
+        >>> afp.load("statements.afp")
         """
-        Get all pages from afp data
+        assert phase == None or phase in Stats.PHASES, f"Unknown phase {phase!r}"
+        self.hooks.setdefault(phase, []).append(func)
+
+    def _endPhase(self, phase, start):
         """
-        assert self.data, "No data loaded"
-        self.pages = self._getFieldsBetween(SF_BPG, SF_EPG)
-        return len(self.pages)
+        Record the time since start against phase and call its hooks, returns the end time
+        """
+        end = time.perf_counter()
+        elapsed = end - start
+
+        if self.stats != None:
+            with self._lock:
+                self.stats.timings[phase] += elapsed
+
+        for hooks in (self.hooks.get(phase), self.hooks.get(None)):
+            if hooks:
+                for func in hooks:
+                    func(self, phase, elapsed)
+
+        return end
+
+    def statsInfo(self):
+        """
+        Return the collected statistics as a dict (see Stats.info), None if stats are off
+        """
+        if self.stats == None:
+            return None
+        return self.stats.info(self.unknown_field_count, self.unhandled_functions)
+
+    def cacheInfo(self):
+        """
+        Return the parsed page cache counters (hits, misses, size, maxsize)
+        """
+        return self.page_cache.info()
 
     def _parsePTOCAdat(self, data):
         """
         Parse the PTOCAdat
+
+        Each control sequence's function code is looked up in the
+        afp_function_ops table and the state (ami, amb, color and
+        orientation) is kept in locals. The decoding tables map every byte
+        to one character so the whole payload is decoded once and TRN text
+        is sliced from that, no bytes (or memoryviews) are sliced out per
+        control sequence. Functions we don't handle (or don't know) are
+        counted in self.unhandled_functions.
         """
+        if self.stats != None:
+            with self._lock:
+                self.stats.countFunctions(data)
+
         # Init states..
         orientation = 0
         color = 0
         ami = 0
         amb = 0
 
-        PTOCA = []
+        PTOCA = ElementArray() if self.compact_elements else []
+
+        # Indexing bytes is faster than indexing a memoryview, one copy of the
+        # payload is cheaper than paying that for every control sequence..
+        if isinstance(data, memoryview):
+            data = data.tobytes()
+
+        ops = afp_function_ops
+        decoded = codecs.charmap_decode(data, "strict", self._decoding_tables[1])[0]
+        unpack_H = _PTOCA_H.unpack_from
+        unpack_HH = _PTOCA_HH.unpack_from
+        unpack_rule = _PTOCA_RULE.unpack_from
 
         offset = 0
+        size = len(data)
         chained = False
-        while offset < len(data):
+        while offset < size:
             if not chained:
                 # Check ESC SEQ..
-                esc_seq = int.from_bytes(data[offset:offset+2], byteorder="big")
-                assert esc_seq == 0x2bd3, f"Escape sequence not correct! ({hex(esc_seq)} should be 0x2bd3)"
+                if data[offset] != 0x2b or data[offset+1] != 0xd3:
+                    esc_seq = int.from_bytes(data[offset:offset+2], byteorder="big")
+                    assert 0, f"Escape sequence not correct! ({hex(esc_seq)} should be 0x2bd3)"
                 offset += 2
 
-            # Get length, function and data..
+            # Get length, function and data offset..
             length = data[offset] # This is full length of record
             assert length, "no length function?!"
             function = data[offset+1]
-            assert function in afp_functions_desc, f"Function {hex(function)} not defined"
-            function_data = data[offset+2:offset+length]
+            start = offset+2
             # move offset..
             offset += length
 
             # Handle functions..
-            if function in afp_functions["STO"]:
-                # Set Text Orientation
-                result = struct.unpack(">HH", function_data)
+            op = ops[function]
+            if op == OP_TRN:
+                # Transparent Data
+                # Decode this data from EBCDIC to ASCII (quotes are fixed by the table)
+                # and add to PTOCA list..
+                PTOCA.append((ami, amb, color, orientation, decoded[start:offset]))
 
-                if result[0] and not result[1]:
-                    orientation = 1 # Landscape
-                elif result[1] and not result[0]:
-                    orientation = 0 # Portrait
-                else:
-                    assert 0, "bad orientation?!"
+            elif op == OP_AMI:
+                # Absolute Move Inline
+                # The range for this parameter assumes a measurement unit of 1/1440 inch
+                ami = unpack_H(data, start)[0] if length == 4 else int.from_bytes(data[start:offset], byteorder="big")
 
-            elif function in afp_functions["AMB"]:
+            elif op == OP_AMB:
                 # Absolute Move Baseline
-                amb = int.from_bytes(function_data, byteorder="big") # The range for this parameter assumes a measurement unit of 1/1440 inch
+                # The range for this parameter assumes a measurement unit of 1/1440 inch
+                amb = unpack_H(data, start)[0] if length == 4 else int.from_bytes(data[start:offset], byteorder="big")
 
-            elif function in afp_functions["AMI"]:
-                # Absolute Move Inline
-                ami = int.from_bytes(function_data, byteorder="big") # The range for this parameter assumes a measurement unit of 1/1440 inch
+            elif op == OP_IGNORE:
+                # Ignore these functions
+                pass
 
-            elif function in afp_functions["STC"]:
+            elif op == OP_STC:
                 # Set Text Color
-                color = afp_clut[int.from_bytes(function_data, byteorder="big")]
+                color = afp_clut[int.from_bytes(data[start:offset], byteorder="big")]
 
-            elif function in afp_functions["SEC"]:
+            elif op == OP_SEC:
                 # Set Extended Text Color
-                assert function_data[0] == 0, f"reserved, must be zero ({function_data[0]})"
-                assert function_data[1] == 1, f"color space not supported ({function_data[1]})" # must be 1 - RGB
-                color = int.from_bytes(function_data[10:13], byteorder="big")
-
-            elif function in afp_functions["TRN"]:
-                # Transparent Data
-                # Decode this data from EBCDIC to ASCII
-                text = self.toASCII(function_data)
-                text = re.sub(r"\x16|\x91", r"'", text) # Fix quotes
+                assert data[start] == 0, f"reserved, must be zero ({data[start]})"
+                assert data[start+1] == 1, f"color space not supported ({data[start+1]})" # must be 1 - RGB
+                color = int.from_bytes(data[start+10:start+13], byteorder="big")
 
-                # Add to PTOCA list..
-                PTOCA.append((ami, amb, color, orientation, text))
-
-            elif function in afp_functions["RMI"]:
-                # Relative Move Inline
-                pass
-
-            elif function in afp_functions["RMB"]:
-                # Relative Move Baseline
-                pass
+            elif op == OP_STO:
+                # Set Text Orientation
+                result = unpack_HH(data, start)
 
-            elif function in afp_functions["DBR"]:
-                # Draw B-Axis Rule
-                # Orientation is not used so -1
-                r_len = int.from_bytes(function_data[0:2], byteorder="big") # length of rule in B direction
-                r_wid = int.from_bytes(function_data[2:4], byteorder="big") # width of rule in I direction (-32765 to +32767)
-                r_fra = function_data[4] # fraction (bit 0 denotes 1/2 measurement unit, bit 1 denotes 1/4 measurement unit etc..)
-                PTOCA.append((ami, amb, color, -1, ("B-Rule", r_len, r_wid, r_fra)))
+                if result[0] and not result[1]:
+                    orientation = 1 # Landscape
+                elif result[1] and not result[0]:
+                    orientation = 0 # Portrait
+                else:
+                    assert 0, "bad orientation?!"
 
-            elif function in afp_functions["DIR"]:
-                # Draw I-Axis Rule
+            elif op == OP_DIR or op == OP_DBR:
+                # Draw I-Axis or B-Axis Rule
                 # Orientation is not used so -1
-                r_len = int.from_bytes(function_data[0:2], byteorder="big") # length of rule in B direction
-                r_wid = int.from_bytes(function_data[2:4], byteorder="big") # width of rule in I direction (-32765 to +32767)
-                r_fra = function_data[4] # fraction (bit 0 denotes 1/2 measurement unit, bit 1 denotes 1/4 measurement unit etc..)
-                PTOCA.append((ami, amb, color, -1, ("I-Rule", r_len, r_wid, r_fra)))
-
-            elif function in afp_functions["NOP"] + afp_functions["SCFL"] + afp_functions["SIA"] + afp_functions["SVI"]:
-                # Ignore these functions
-                pass
+                # length of rule, width of rule (-32765 to +32767) and fraction (bit 0 denotes
+                # 1/2 measurement unit, bit 1 denotes 1/4 measurement unit etc..)
+                r_len, r_wid, r_fra = unpack_rule(data, start)
+                PTOCA.append((ami, amb, color, -1, ("I-Rule" if op == OP_DIR else "B-Rule", r_len, r_wid, r_fra)))
 
             else:
-                print(f"Warning: Unhandled function {hex(function)} ({afp_functions.get(function)})")
+                # Unhandled or unknown function
+                with self._lock:
+                    self.unhandled_functions[function] = self.unhandled_functions.get(function, 0) + 1
 
             # chained or unchained function?
-            chained = True if function % 2 else False
+            chained = function & 1
 
         assert not chained, "Final function is chained!"
 
@@ -844,7 +3301,23 @@ class AshyAFP(object):
         """
         assert page_data, "No data"
 
-        allTexts = []
+        if self.stats == None and not self.hooks:
+            return self._parsePage(page_data)
+
+        start = time.perf_counter()
+        page = self._parsePage(page_data)
+        if self.stats != None:
+            with self._lock:
+                self.stats.pages_parsed += 1
+        self._endPhase("pages", start)
+        return page
+
+    def _parsePage(self, page_data):
+        """
+        Parse the fields of a page into a Page, see parsePage
+        """
+        parts = [] # Runs of page elements and PlacedOverlays
+        allTexts = ElementArray() if self.compact_elements else []
 
         # Get all objects
         for f_id, f_dat in page_data:
@@ -852,22 +3325,49 @@ class AshyAFP(object):
                 # Text object
                 allTexts.extend(self._parsePTOCAdat(f_dat))
 
-            elif f_id == SF_IPO:
+            elif f_id == SF_IPO and self.incorporateOverlays:
                 # Overlay
                 name = self.toASCII(f_dat[0:8])
                 xorigin = int.from_bytes(f_dat[8:11], byteorder="big")
                 yorigin = int.from_bytes(f_dat[11:14], byteorder="big")
                 orient = int.from_bytes(f_dat[14:16], byteorder="big") if len(f_dat) >= 16 else None # orientation is an optional entry
 
-                for g_id, g_dat in self.resources.get(name):
+                # The overlay's text elements are shared by every page including it,
+                # they only get moved by the x and y offsets when the page's elements are used..
+                overlay = self._getOverlay(name)
+                if overlay:
+                    if allTexts:
+                        parts.append(allTexts)
+                        allTexts = ElementArray() if self.compact_elements else []
+                    parts.append(PlacedOverlay(name, overlay, xorigin, yorigin))
+
+        if not parts:
+            return Page(elements=allTexts, columnar=self.columnar, line_tolerance=self.line_tolerance, line_gap=self.line_gap)
+
+        if allTexts:
+            parts.append(allTexts)
+        return Page(parts=parts, columnar=self.columnar, line_tolerance=self.line_tolerance, line_gap=self.line_gap)
+
+    def _getOverlay(self, name):
+        """
+        Return the text elements of overlay resource name (relative to its
+        origin) as a tuple, or an ElementArray with compact_elements. Each
+        overlay is only parsed once.
+        """
+        overlay = self.overlays.get(name)
+        if overlay == None:
+            elements = ElementArray() if self.compact_elements else []
+            res = self.resources.get(name)
+            if res != None and not isinstance(res, bytes):
+                for g_id, g_dat in res:
                     if g_id == SF_PTX: # Text object in overlay
-                        newTexts = self._parsePTOCAdat(g_dat)
-                        # Add text elements to allTexts with modified position
-                        # based on x and y offsets defined in the overlay..
-                        for t in newTexts:
-                            allTexts.append((t[0]+xorigin, t[1]+yorigin) + t[2:])
+                        elements.extend(self._parsePTOCAdat(g_dat))
 
-        return Page(elements=allTexts)
+            # Another thread may have parsed it too, keep the first one..
+            with self._lock:
+                overlay = self.overlays.setdefault(name, elements if self.compact_elements else tuple(elements))
+
+        return overlay
 
     def printStats(self):
         assert self.data, "No data loaded."
@@ -875,87 +3375,719 @@ class AshyAFP(object):
         print(f"-- AFP Stats for {self.filename!r} --")
         print(f"   Load time:    {self.loadtime:.2f}s")
         print(f"   Total fields: {len(self.data)}" + (f" ({self.unknown_field_count} UNKNOWN)" if self.unknown_field_count else ""))
+        if isinstance(self.data, FieldIndex):
+            print(f"   Index size:   {self.data.indexSize()} bytes ({'mmap' if self._mmap != None else 'memory'})")
+        if self._filtering():
+            print(f"   Skipped:      {self.skipped_bytes} bytes (field filter)")
         print(f"   Resources:    {self.resource_count}")
         print(f"   Documents:    {self.document_count}")
         print(f"   Pages:        {self.page_count}")
+
+        if self.stats != None:
+            info = self.statsInfo()
+            print("   Timings:      " + ", ".join(f"{k} {v:.3f}s" for k, v in info["timings"].items()))
+            print(f"   Pages parsed: {info['pages_parsed']}")
+            for name, field in sorted(info["fields"].items(), key=lambda i: -i[1]["bytes"])[:10]:
+                print(f"   {field['count']:8} {field['bytes']:12} bytes  {name}")
+            if info["unknown_functions"] or info["unhandled_functions"]:
+                print(f"   Unhandled PTOCA functions: {info['unhandled_functions']}, unknown: {info['unknown_functions']}")
         print(f"-- End Stats --")
 
-    def load(self, filename):
+    def setFieldFilter(self, include_fields=None, exclude_fields=None):
         """
-        Load the AFP data into ram and parse docs/pages/resources
+        Only read the payloads of the field types in include_fields (None for
+        all of them) that are not in exclude_fields. Other fields keep their
+        place (and id) in self.data but with an empty payload, their data is
+        seeked past (or never touched in the mmap) so it is never read.
+        Begin and End fields are always read as the structure needs them,
+        as are FILTER_KEEP_FIELDS (overlay includes and code pages).
+
+        Example, text and TLEs without images, graphics or font rasters:
+        >>> afp = AshyAFP("cheques.afp", exclude_fields=BULK_DATA_FIELDS)
         """
-        self.filename = filename
-        start_time = time.time()
-        print(f"Loading AFP {filename!r}..")
+        self.include_fields = frozenset(include_fields) if include_fields != None else None
+        self.exclude_fields = frozenset(exclude_fields or ())
 
-        self.data = [] # Will contain list of tuples (id, data)
+    def _filtering(self):
+        return self.include_fields != None or bool(self.exclude_fields)
 
-        start_time = time.time()
-        with open(filename, "rb") as fp:
-            while fp:
-                data = fp.read(9)
-                if not data:
-                    break # End of file
+    def _skipField(self, sf_id):
+        """
+        Return True if the payload of sf_id should not be read
+        """
+        if (sf_id >> 8) & 0xff in (0xa8, 0xa9) or sf_id in FILTER_KEEP_FIELDS:
+            return False # Begin/End, overlay includes and code pages
+        if sf_id in self.exclude_fields:
+            return True
+        return self.include_fields != None and sf_id not in self.include_fields
+
+    def _checkField(self, sf_id, offset):
+        """
+        Debug output and unknown field handling for a field header at offset
+        """
+        if self.debug:
+            print(f"{offset} {hex(sf_id)} {afp_fields.get(sf_id, '-Unknown-')}")
+
+        if not self.allow_unknown_fields:
+            assert sf_id in afp_fields, f"Unknown field id {hex(sf_id)}"
 
-                sf_ccc, sf_len, sf_id = struct.unpack(">BH3s3x", data)
-                assert sf_ccc == 0x5A, "Carriage control char missing"
+        if sf_id not in afp_fields:
+            self.unknown_field_count += 1
 
-                sf_len += 1 # length does not take into account the CARRIAGE_CONTROL_CHAR so add one
-                sf_id = int.from_bytes(sf_id, byteorder="big")
+    def _readFields(self, fp):
+        """
+        Generator reading structured fields from fp, yields tuples of (id, data)
+        """
+        filtering = self._filtering()
+        while fp:
+            data = fp.read(9)
+            if not data:
+                break # End of file
 
-                if self.debug:
-                    print(f"{fp.tell()-9} {hex(sf_id)} {afp_fields.get(sf_id, '-Unknown-')}")
+            sf_ccc, sf_len, sf_id = struct.unpack(">BH3s3x", data)
+            assert sf_ccc == 0x5A, "Carriage control char missing"
 
-                if not self.allow_unknown_fields:
-                    assert sf_id in afp_fields, f"Unknown field id {hex(sf_id)}"
+            sf_len += 1 # length does not take into account the CARRIAGE_CONTROL_CHAR so add one
+            sf_id = int.from_bytes(sf_id, byteorder="big")
 
-                if sf_id not in afp_fields:
-                    self.unknown_field_count += 1
+            self._checkField(sf_id, fp.tell()-9)
 
-                # Read this records data..
+            # Read this records data..
+            if filtering and self._skipField(sf_id):
+                fp.seek(sf_len-9, io.SEEK_CUR)
+                self.skipped_bytes += sf_len-9
+                sf_data = b""
+            else:
                 sf_data = fp.read(sf_len-9) # Minus 9 as we have already read 9 bytes
 
-                # add to data dict..
-                self.data.append((sf_id, sf_data))
+            yield (sf_id, sf_data)
+
+    def _indexFields(self, buffer):
+        """
+        Build a FieldIndex from the structured field headers in buffer.
+        Only the 9 byte headers are read, payloads are left in the buffer.
+        """
+        index = FieldIndex(buffer)
+        unpack_from = SF_HEADER.unpack_from
+        size = len(buffer)
+        filtering = self._filtering()
+
+        offset = 0
+        while offset < size:
+            sf_ccc, sf_len, sf_id_hi, sf_id_lo = unpack_from(buffer, offset)
+            assert sf_ccc == 0x5A, "Carriage control char missing"
+
+            sf_id = (sf_id_hi << 16) | sf_id_lo
+            self._checkField(sf_id, offset)
+
+            # length does not take into account the CARRIAGE_CONTROL_CHAR so add one..
+            end = offset + sf_len + 1
+            assert end <= size, f"Field {hex(sf_id)} at {offset} is truncated"
+
+            length = end-offset-SF_HEADER_SIZE
+            if filtering and self._skipField(sf_id):
+                self.skipped_bytes += length
+                length = 0
+            index.append(sf_id, offset+SF_HEADER_SIZE, length)
+            offset = end
+
+        return index
+
+    def _mapFile(self, filename):
+        """
+        Memory-map filename and return a FieldIndex over it
+        """
+        self._fp = open(filename, "rb")
+        if not os.fstat(self._fp.fileno()).st_size:
+            return FieldIndex(b"") # Can't map an empty file
+
+        self._mmap = mmap.mmap(self._fp.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._indexFields(self._mmap)
+
+    def close(self):
+        """
+        Release the memory-map and file handle used in mmap mode
+        """
+        if isinstance(self.data, FieldIndex):
+            self.data.release()
+
+        if self._mmap != None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                pass # Payload views are still in use, it is unmapped once they are freed
+            self._mmap = None
+        if self._fp != None:
+            self._fp.close()
+            self._fp = None
+
+    def _fieldFilterKey(self):
+        """
+        Return the field filter as JSON-able lists for the sidecar index header
+        """
+        return [sorted(self.include_fields) if self.include_fields != None else None, sorted(self.exclude_fields)]
+
+    def _indexFilename(self, filename):
+        return self.index_file or filename + INDEX_SUFFIX
+
+    def _fileSignature(self, filename):
+        """
+        Return the size, mtime and content hash used to check a sidecar index
+        is still valid. Only the first and last INDEX_HASH_CHUNK bytes are
+        hashed (with the size) so checking stays fast on huge spools.
+        """
+        stat = os.stat(filename)
+        digest = hashlib.blake2b(stat.st_size.to_bytes(8, byteorder="big"), digest_size=16)
+
+        with open(filename, "rb") as fp:
+            digest.update(fp.read(INDEX_HASH_CHUNK))
+            if stat.st_size > INDEX_HASH_CHUNK:
+                fp.seek(max(INDEX_HASH_CHUNK, stat.st_size - INDEX_HASH_CHUNK))
+                digest.update(fp.read())
+
+        return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "hash": digest.hexdigest()}
+
+    def _fieldArrays(self):
+        """
+        Return the offsets, lengths and ids arrays of self.data
+        """
+        if isinstance(self.data, FieldIndex):
+            return self.data.offsets, self.data.lengths, self.data.ids
+
+        offsets, lengths, ids = array("Q"), array("H"), array("I")
+
+        if self._filtering():
+            # Filtered payloads were never read so their real lengths come
+            # from the file's headers..
+            with open(self.filename, "rb") as fp:
+                for (f_id, f_dat), (h_id, begin, end, data) in zip(self.data, self._scanHeaders(fp, check=False)):
+                    assert f_id == h_id, f"{self.filename!r} has changed since it was loaded"
+                    offsets.append(begin + SF_HEADER_SIZE)
+                    lengths.append(len(f_dat))
+                    ids.append(f_id)
+            return offsets, lengths, ids
+
+        offset = 0
+        for f_id, f_dat in self.data:
+            offset += SF_HEADER_SIZE
+            offsets.append(offset)
+            lengths.append(len(f_dat))
+            ids.append(f_id)
+            offset += len(f_dat)
+
+        return offsets, lengths, ids
+
+    def saveIndex(self, index_file=None):
+        """
+        Write a sidecar index for the loaded file, holding the field offsets,
+        the structure tree, resource locations and the parsed TLEs of every
+        document. load() uses it instead of reading the file when use_index
+        is set and the file's size, mtime and hash still match.
+
+        Returns the index filename.
+        """
+        assert self.data != None and self.filename, "No data loaded"
+        if self.structure == None:
+            self.structure = self._buildStructure()
+
+        index_file = index_file or self._indexFilename(self.filename)
+
+        self._writeSidecar(index_file, {
+            "unknown_field_count": self.unknown_field_count,
+            "field_filter": self._fieldFilterKey(),
+            "resources": [(node.start, node.end) for node in self.structure.find(SF_BRS)],
+            "tles": [doc.tle for doc in self.documents] if self.documents else None,
+            }, self._fieldArrays() + self.structure.toArrays())
+
+        return index_file
+
+    def _writeSidecar(self, path, header, arrays):
+        """
+        Write a sidecar file for self.filename: INDEX_MAGIC, a JSON header
+        (with the file's signature) and the raw arrays
+        """
+        header = dict(self._fileSignature(self.filename), version=INDEX_VERSION, byteorder=sys.byteorder,
+            arrays=[(a.typecode, len(a)) for a in arrays], **header)
+
+        # Write to a temporary file first so readers never see half of one..
+        try:
+            with open(path + ".tmp", "wb") as fp:
+                fp.write(INDEX_MAGIC)
+                fp.write(json.dumps(header).encode("utf-8") + b"\n")
+                for a in arrays:
+                    a.tofile(fp)
+            os.replace(path + ".tmp", path)
+        except OSError:
+            with contextlib.suppress(OSError):
+                os.remove(path + ".tmp")
+            raise
+
+    def _readSidecar(self, path, filename, keys=()):
+        """
+        Return the (header, arrays) of sidecar file path if it exists, still
+        matches filename and its header has all of keys, otherwise None.
+        A corrupt or truncated sidecar is treated as stale.
+        """
+        if not os.path.exists(path):
+            return None
+
+        try:
+            with open(path, "rb") as fp:
+                if fp.read(len(INDEX_MAGIC)) != INDEX_MAGIC:
+                    return None
+
+                header = json.loads(fp.readline())
+                if not isinstance(header, dict) or header.get("version") != INDEX_VERSION:
+                    return None
+                if any(k not in header for k in keys):
+                    return None
+
+                signature = self._fileSignature(filename)
+                if any(header.get(k) != v for k, v in signature.items()):
+                    return None # Stale
+
+                arrays = []
+                for typecode, count in header["arrays"]:
+                    a = array(typecode)
+                    a.fromfile(fp, count)
+                    if header["byteorder"] != sys.byteorder:
+                        a.byteswap()
+                    arrays.append(a)
+
+        except (ValueError, EOFError, KeyError, TypeError):
+            return None # Corrupt or truncated..
+
+        return header, arrays
+
+    def _loadIndex(self, filename):
+        """
+        Load the sidecar index for filename if it exists and matches the
+        file. Sets self.data (a FieldIndex over the mmapped file) and
+        self.structure, returns the index header or None.
+        """
+        result = self._readSidecar(self._indexFilename(filename), filename,
+            ("size", "unknown_field_count", "field_filter", "resources", "tles"))
+        if result == None:
+            return None
+
+        header, arrays = result
+        if header.get("field_filter") != self._fieldFilterKey():
+            return None # Made with a different field filter
+
+        if not self.allow_unknown_fields:
+            assert not header["unknown_field_count"], f"{header['unknown_field_count']} unknown fields in {filename!r}"
+
+        offsets, lengths, ids = arrays[:3]
+        self._fp = open(filename, "rb")
+        if header["size"]:
+            self._mmap = mmap.mmap(self._fp.fileno(), 0, access=mmap.ACCESS_READ)
+
+        self.data = FieldIndex(self._mmap if self._mmap != None else b"", offsets, lengths, ids)
+        self.structure = StructureNode.fromArrays(*arrays[3:])
+        self.unknown_field_count = header["unknown_field_count"]
+
+        return header
+
+    def load(self, filename, use_mmap=None, include_fields=None, exclude_fields=None):
+        """
+        Load the AFP data into ram and parse docs/pages/resources
+
+        If use_mmap is True the file is memory-mapped instead and self.data
+        becomes a FieldIndex, so payloads are only read when they are used.
+        With zero_copy self.data is a FieldIndex handing out payloads as
+        memoryviews of the mmap (or of the file read in one go).
+
+        If use_index is True and a valid sidecar index exists the file is
+        memory-mapped and the fields, structure, resource locations and TLEs
+        come from the index, otherwise the index is written after loading
+        (if it can be, the load doesn't fail on a read-only folder).
+        Documents are built when they are first used.
+
+        include_fields and exclude_fields replace the field filter if given,
+        see setFieldFilter().
+        """
+        self.filename = filename
+        print(f"Loading AFP {filename!r}..")
+
+        if use_mmap != None:
+            self.use_mmap = use_mmap
+        if include_fields != None or exclude_fields != None:
+            self.setFieldFilter(include_fields, exclude_fields)
+        self.skipped_bytes = 0
+
+        self.close()
+        self.overlays = {}
+        self.page_cache.clear()
+        self._resetCodepage()
+        self.documents = self.pages = self.parsedPages = None
+        self.document_count = self.page_count = 0
+        self.tle_index = self.document_tles = self.offsets = None
+        self.text_index = None
+
+        # Phases are only timed when someone is listening..
+        if self.stats != None:
+            self.stats = Stats()
+        timed = self.stats != None or self.hooks
+
+        start_time = time.time()
+        load_start = phase_start = time.perf_counter() if timed else None
+
+        index = self._loadIndex(filename) if self.use_index else None
+        self.index_loaded = index != None
+
+        if index != None:
+            pass # Fields come from the index
+        elif self.use_mmap or self.use_index or (self.zero_copy and self._filtering()):
+            # (zero_copy maps the file when filtering so skipped payloads aren't read)
+            self.data = self._mapFile(filename)
+        elif self.zero_copy:
+            with open(filename, "rb") as fp:
+                self.data = self._indexFields(fp.read()) # One read, payloads stay in it
+        else:
+            with open(filename, "rb") as fp:
+                self.data = list(self._readFields(fp)) # Will contain list of tuples (id, data)
+
+        if self.zero_copy:
+            self.data.useViews()
+
+        if timed:
+            phase_start = self._endPhase("read", phase_start)
+            if self.stats != None:
+                self.stats.countFields(self.data)
+
+        # Build the Begin/End tree in one pass, everything else uses it..
+        if index == None:
+            self.structure = self._buildStructure()
+        if timed:
+            phase_start = self._endPhase("structure", phase_start)
 
         # Do resources..
-        self.resource_count = self._getResources()
+        self.resource_count = self._getResources(index["resources"] if index != None else None)
+        if timed:
+            phase_start = self._endPhase("resources", phase_start)
 
         # Do we have documents or pages?
-        if self.countFields(SF_BNG) > 1:
+        if index != None and index["tles"] != None:
+            self.document_count = self._getDocuments(index["tles"])
+        elif index == None and len(self.structure.tree.findNumbers(SF_BNG)) > 1:
             self.document_count = self._getDocuments()
         else:
             self.page_count = self._getPages()
+        if timed:
+            self._endPhase("documents", phase_start)
+            self._endPhase("load", load_start)
+
+        if self.use_index and index == None:
+            try:
+                self.saveIndex()
+            except OSError:
+                pass # ie. a read-only archive, carry on without the index
 
         self.loadtime = time.time()-start_time
         return True # Huge Success
 
 
-if __name__ == "__main__":
-    a = AshyAFP(r"test.afp")
-    a.printStats()
-    page = a.parsePage(a.pages[0])
+# Process pool workers for AshyAFP.mapDocuments..
+_worker_afp = None
+
+def _orderedResults(executor, func, jobs, ahead):
+    """
+    Yield func(*job) for every job run on executor in job order, with at
+    most ahead of them submitted at a time (executor.map submits them all)
+    """
+    pending = deque()
+    for job in jobs:
+        pending.append(executor.submit(func, *job))
+        if len(pending) >= ahead:
+            yield pending.popleft().result()
+
+    while pending:
+        yield pending.popleft().result()
+
+def _parallelInit(cls, filename, res_ranges, options):
+    """
+    Process pool initializer, parse the shared resources once per worker
+    """
+    global _worker_afp
+    _worker_afp = cls(**options)
+    _worker_afp.filename = filename
+    _worker_afp.resources = {}
+
+    with open(filename, "rb") as fp:
+        for begin, end in res_ranges:
+            _worker_afp._parseResource(_worker_afp._readRange(fp, begin, end))
+    _worker_afp.resource_count = len(_worker_afp.resources)
+
+def _parallelShard(shard, func):
+    """
+    Parse all documents in the byte range shard and return func(doc) for each
+    """
+    begin, end = shard
+    results = []
+    with open(_worker_afp.filename, "rb") as fp:
+        fp.seek(begin)
+        for doc in _worker_afp._streamDocuments(io.BytesIO(fp.read(end-begin))):
+            if func == None:
+                results.append(Document(pages=list(doc.pages), tle=doc.tle))
+            else:
+                results.append(func(doc))
+
+    return results
+
+
+# Batch command line..
+BATCH_OUTPUTS = {
+    # Output type: CSV columns
+    "text": ("file", "document", "page", "text"),
+    "elements": ("file", "document", "page", "x", "y", "color", "orientation", "text"),
+    "rules": ("file", "document", "page", "x", "y", "color", "rule", "length", "width", "fraction"),
+    "tles": ("file", "document", "key", "value"),
+    "images": ("file", "name", "format", "bytes", "path"),
+    }
+
+BATCH_SHARD_SIZE = 100 # Documents (or pages) per batch job
+
+_batch_afp = None # Last file's AshyAFP in a batch worker, reused by its next shard
+
+def _batchJobs(filenames, output, shard_size, options):
+    """
+    Yield a (filename, shard) job for every file, or for every shard of
+    shard_size documents (pages if the file has none) of it for text,
+    elements and rules. Shards come from a header-only scan so no job
+    ever holds a whole file's records. A shard is (kind, first number,
+    byte ranges, resource byte ranges), None is the whole file. A file
+    that can't be scanned gets a single job with the exception as shard
+    so it is reported in order.
+    """
+    for filename in filenames:
+        if output in ("tles", "images"):
+            yield filename, None
+            continue
+
+        afp = AshyAFP(**options)
+        try:
+            afp.scanOffsets(filename, use_index=False)
+        except Exception as error:
+            yield filename, error
+            continue
+        offsets = afp.offsets
+
+        if offsets.documentCount():
+            kind, begins, ends = "documents", offsets.document_begins, offsets.document_ends
+        else:
+            kind, begins, ends = "pages", offsets.page_begins, offsets.page_ends
+
+        for start in range(0, len(begins), shard_size):
+            ranges = list(zip(begins[start:start+shard_size], ends[start:start+shard_size]))
+            yield filename, (kind, start, ranges, offsets.resources)
+
+def _batchAFP(filename, resources, options):
+    """
+    Return an AshyAFP for filename with its resources parsed, the same one
+    is kept for the next shard of the file (shards are handed out in order)
+    """
+    global _batch_afp
+    if _batch_afp == None or _batch_afp.filename != filename:
+        # Only kept once all resources are parsed, a failed file is retried by its next shard..
+        _batch_afp = None
+        afp = AshyAFP(**options)
+        afp.filename = filename
+        afp.resources = {}
+        with open(filename, "rb") as fp:
+            for begin, end in resources:
+                afp._parseResource(afp._readRange(fp, begin, end))
+        _batch_afp = afp
+    return _batch_afp
+
+def _batchImageFolders(filenames, images_dir):
+    """
+    Return {filename: folder} for --output-type images. Folders mirror the
+    files' paths below their common folder so spools with the same name in
+    different folders don't overwrite each other's images.
+    """
+    paths = [os.path.abspath(i) for i in filenames]
+    root = os.path.commonpath([os.path.dirname(i) for i in paths])
+
+    folders = {}
+    for filename, path in zip(filenames, paths):
+        relative = os.path.relpath(path, root)
+        folder = os.path.join(images_dir, os.path.splitext(relative)[0])
+        if folder in folders.values():
+            folder = os.path.join(images_dir, relative) # ie. spool.afp and spool.AFP in one folder..
+        folders[filename] = folder
+    return folders
+
+def _batchJob(filename, shard, output, images_folder, options):
+    """
+    Process one job from _batchJobs() for the batch command line (runs in
+    the process pool). Returns (filename, records, page count, error), the
+    error is None unless the job failed so the rest of the batch carries on.
+    """
+    try:
+        return (filename,) + _batchExtract(filename, shard, output, images_folder, options) + (None,)
+    except Exception as error:
+        return filename, [], 0, f"{type(error).__name__}: {error}"
+
+def _batchExtract(filename, shard, output, images_folder, options):
+    """
+    Extract the records of one job for _batchJob(), returns (records, page count)
+    """
+    if isinstance(shard, Exception):
+        raise shard # The header-only scan of the file failed
+
+    records = []
+
+    if output == "tles":
+        afp = AshyAFP(**options)
+        afp.scanTLEs(filename, use_index=False) # Header-only, no pages are parsed
+        for doc_num, tle in enumerate(afp.document_tles):
+            records.extend({"file": filename, "document": doc_num, "key": k, "value": v} for k, v in tle.items())
+        return records, afp.offsets.pageCount()
+
+    if output == "images":
+        with contextlib.redirect_stdout(io.StringIO()): # load() prints progress
+            afp = AshyAFP(filename, **options)
+        try:
+            for image in afp.iterImageResources():
+                os.makedirs(images_folder, exist_ok=True)
+                path = os.path.join(images_folder, f"{image.name}.{image.format()}")
+                with open(path, "wb") as fp:
+                    size = image.writeTo(fp)
+                records.append({"file": filename, "name": image.name, "format": image.format(), "bytes": size, "path": path})
+            pages = sum(len(doc.pages) for doc in afp.documents) if afp.documents else len(afp.parsedPages or ())
+        finally:
+            afp.close()
+        return records, pages
+
+    kind, start, ranges, resources = shard
+    afp = _batchAFP(filename, resources, options)
+    pages = 0
+
+    with open(filename, "rb") as fp:
+        for number, (begin, end) in enumerate(ranges, start):
+            fields = afp._readRange(fp, begin, end)
+            if kind == "documents":
+                doc_num = number
+                doc = afp._buildDocument(afp._buildStructure(fields).children[0], fields)
+                doc_pages = enumerate(doc.pages)
+            else:
+                doc_num = 0
+                doc_pages = ((number, afp.parsePage(fields)),)
+
+            for page_num, page in doc_pages:
+                pages += 1
+                if output == "text":
+                    records.append({"file": filename, "document": doc_num, "page": page_num, "text": page.getText()})
+
+                elif output == "elements":
+                    records.extend({"file": filename, "document": doc_num, "page": page_num, "x": x, "y": y, "color": color, "orientation": orientation, "text": text}
+                        for x, y, color, orientation, text in page.getTextElements())
+
+                elif output == "rules" and page.elements:
+                    records.extend({"file": filename, "document": doc_num, "page": page_num, "x": x, "y": y, "color": color, "rule": rule[0], "length": rule[1], "width": rule[2], "fraction": rule[3]}
+                        for x, y, color, orientation, rule in page.getRules())
 
-    # Find text pos..
-    pos = page.findTextPos("README")
-    print(f"\nThe text 'README' was found at position {pos}.")
+    return records, pages
 
-    # Find text element..
-    elem = page.findText("README")[0]
-    print(f"The text element for 'README' looks like {elem}")
+def _batchFilenames(paths, pattern="*.afp"):
+    """
+    Expand files, directories (searched recursively for pattern) and globs to a list of filenames
+    """
+    filenames = []
+    for path in paths:
+        if os.path.isdir(path):
+            filenames.extend(sorted(glob.glob(os.path.join(path, "**", pattern), recursive=True)))
+        elif os.path.exists(path):
+            filenames.append(path)
+        else:
+            filenames.extend(sorted(glob.glob(path, recursive=True)))
+
+    # Paths given more than once (ie. a folder and a glob) are only done once..
+    return list(dict.fromkeys(i for i in filenames if os.path.isfile(i)))
 
-    # Get area text..
-    area = (0, 4583, 10000, 5300)
-    text = page.getText(area=area, delimiter="")
-    print(f"The area {area}, contains this text: {text}")
+def main(argv=None):
+    """
+    Batch command line, extract text, elements, rules, TLEs or images from
+    AFP files in a process pool and write them as JSONL or CSV.
 
-    # Find text with color..
-    text = page.findText("", color=0x197f33)
-    print(f"Find texts with color 0x197f33: {text}")
+    Example:
+        python AshyAFP.py spools/ -o text.jsonl --workers 8
+        python AshyAFP.py "2024/**/*.afp" --output-type tles --format csv
+    """
+    parser = argparse.ArgumentParser(description="Extract text, elements, rules, TLEs or images from AFP files")
+    parser.add_argument("paths", nargs="+", help="AFP files, directories or globs")
+    parser.add_argument("-t", "--output-type", choices=tuple(BATCH_OUTPUTS), default="text", help="what to extract (default text)")
+    parser.add_argument("-f", "--format", choices=("jsonl", "csv"), default="jsonl", help="output format (default jsonl)")
+    parser.add_argument("-o", "--output", help="output file (default stdout)")
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count() or 1, help="worker processes (default cpu count)")
+    parser.add_argument("--pattern", default="*.afp", help="filename pattern for directories (default *.afp)")
+    parser.add_argument("--images-dir", default="images", help="folder for --output-type images, a subfolder per file (default images)")
+    parser.add_argument("--shard-size", type=int, default=BATCH_SHARD_SIZE, help=f"documents (or pages) per job for text, elements and rules (default {BATCH_SHARD_SIZE})")
+    parser.add_argument("--use-mmap", action="store_true", help="memory-map the files")
+    parser.add_argument("--codepage", help="code page to decode text with (default from the file)")
+    parser.add_argument("--allow-unknown-fields", action="store_true", help="don't stop on unknown structured fields")
+    args = parser.parse_args(argv)
+
+    filenames = _batchFilenames(args.paths, args.pattern)
+    if not filenames:
+        parser.error("no AFP files found")
+
+    options = {"use_mmap": args.use_mmap, "codepage": args.codepage, "allow_unknown_fields": args.allow_unknown_fields,
+        "page_cache_size": 0, "stream_images": args.output_type == "images"}
+
+    fp = open(args.output, "w", newline="", encoding="utf-8") if args.output else sys.stdout
+    if args.format == "csv":
+        writer = csv.DictWriter(fp, fieldnames=BATCH_OUTPUTS[args.output_type])
+        writer.writeheader()
+        write = writer.writerow
+    else:
+        write = lambda record: fp.write(json.dumps(record) + "\n")
+
+    start_time = time.time()
+    pages = 0
+    failed = set()
+
+    folders = _batchImageFolders(filenames, args.images_dir) if args.output_type == "images" else {}
+    jobs = ((filename, shard, args.output_type, folders.get(filename), options)
+        for filename, shard in _batchJobs(filenames, args.output_type, max(1, args.shard_size), options))
+    executor = None
+    try:
+        if args.workers > 1:
+            # At most two jobs per worker in flight so finished records don't pile up in memory..
+            executor = concurrent.futures.ProcessPoolExecutor(max_workers=args.workers)
+            results = _orderedResults(executor, _batchJob, jobs, args.workers * 2)
+        else:
+            results = (_batchJob(*job) for job in jobs)
+
+        for filename, records, job_pages, error in results:
+            if error != None:
+                print(f"{filename}: {error}", file=sys.stderr)
+                failed.add(filename)
+            for record in records:
+                write(record)
+            pages += job_pages
+
+    except BrokenPipeError:
+        # Output closed early (ie. piped to head), stop quietly..
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return 1
+
+    finally:
+        if executor != None:
+            executor.shutdown(cancel_futures=True)
+        if fp is not sys.stdout:
+            fp.close()
+
+    files = len(filenames)
+    size = sum(os.path.getsize(i) for i in filenames)
+    elapsed = max(time.time() - start_time, 1e-9)
+    print(f"{files} files, {pages} pages, {size / 1e6:.1f} MB in {elapsed:.2f}s: "
+        f"{files / elapsed:.1f} files/s, {pages / elapsed:.1f} pages/s, {size / 1e6 / elapsed:.1f} MB/s", file=sys.stderr)
+    if failed:
+        print(f"{len(failed)} of {files} files failed", file=sys.stderr)
+        return 1
+    return 0
 
-    # List resources..
-    res = a.resources.keys()
-    print(f"List of resources: {tuple(res)}")
 
-    print("\nFinished!")
-    assert 0
\ No newline at end of file
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,288 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Benchmarks for AshyAFP
+#
+# Writes deterministic synthetic AFP files for a matrix of sizes, times the
+# main AshyAFP operations on each one and outputs the results as JSON so
+# they can be compared between releases.
+#
+# Usage:
+#   python benchmark.py                      # default matrix, JSON to stdout
+#   python benchmark.py --quick -o bench.json
+#   python benchmark.py --documents 1000 --pages 2 --elements 300
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import struct
+import sys
+import tempfile
+import time
+
+import AshyAFP as afp
+
+WORDS = (
+    "Account", "Balance", "Total", "Due", "Statement", "Payment", "Invoice", "Customer",
+    "Date", "Amount", "Reference", "Period", "Interest", "Credit", "Debit", "Opening",
+    "Closing", "Charges", "Summary", "Page", "of", "the", "and", "to", "your",
+    )
+
+
+class SyntheticAFP(object):
+    """
+    Deterministic synthetic AFP writer.
+
+    Produces a resource group (overlays and image resources) followed by a
+    document with Named Page Groups, each with TLEs and pages of PTX text
+    elements, rules and overlay includes. The same parameters and seed
+    always produce the same bytes.
+    """
+    def __init__(self, documents=10, pages=2, elements=100, overlays=1, tles=2, images=(), seed=1, codepage="cp500"):
+        self.documents = documents # Named Page Groups
+        self.pages = pages # Pages per document
+        self.elements = elements # PTX text elements per page
+        self.overlays = overlays # Overlays included on every page
+        self.tles = tles # TLEs per document
+        self.images = tuple(images) # Size in bytes of each image resource
+        self.seed = seed
+        self.codepage = codepage
+
+    def params(self):
+        return {
+            "documents": self.documents,
+            "pages": self.pages,
+            "elements": self.elements,
+            "overlays": self.overlays,
+            "tles": self.tles,
+            "images": list(self.images),
+            "seed": self.seed,
+            }
+
+    def field(self, sf_id, payload=b""):
+        """
+        Return a structured field, introducer plus payload
+        """
+        return struct.pack(">BH3sB2x", 0x5A, len(payload) + 8, sf_id.to_bytes(3, byteorder="big"), 0) + payload
+
+    def name(self, text):
+        return text.ljust(8)[:8].encode(self.codepage)
+
+    def ptx(self, elements, rnd):
+        """
+        Return a PTX payload for the (x, y, text) elements, with some color and rule sequences
+        """
+        data = bytearray()
+        for x, y, text in elements:
+            seq = [bytes((4, 0xc7)) + x.to_bytes(2, byteorder="big"), bytes((4, 0xd3)) + y.to_bytes(2, byteorder="big")]
+            if rnd.random() < 0.1:
+                seq.append(bytes((4, 0x75)) + rnd.choice((0x0001, 0x0002, 0x0008)).to_bytes(2, byteorder="big"))
+            if rnd.random() < 0.05:
+                seq.append(bytes((7, 0xe5)) + rnd.randrange(100, 5000).to_bytes(2, byteorder="big") + (3).to_bytes(2, byteorder="big") + b"\x00")
+
+            text = text.encode(self.codepage)
+            while text:
+                # TRN data is limited to 253 bytes per control sequence..
+                seq.append(bytes((len(text[:253]) + 2, 0xdb if len(text) > 253 else 0xda)) + text[:253])
+                text = text[253:]
+
+            # Chain them all together, the last one is unchained..
+            data += b"\x2b\xd3" + b"".join(seq)
+
+        return bytes(data)
+
+    def ptxFields(self, elements, rnd):
+        """
+        Return PTX fields for elements, split to keep within the field size limit
+        """
+        fields = []
+        for i in range(0, len(elements), 100):
+            fields.append(self.field(afp.SF_PTX, self.ptx(elements[i:i+100], rnd)))
+        return b"".join(fields)
+
+    def text(self, rnd, words=(1, 4)):
+        return " ".join(rnd.choice(WORDS) for i in range(rnd.randint(*words)))
+
+    def write(self, fp):
+        """
+        Write the synthetic AFP to the binary file object fp
+        """
+        rnd = random.Random(self.seed)
+        field = self.field
+        name = self.name
+
+        fp.write(field(afp.SF_BRG, name("RG")))
+
+        # Overlays..
+        for o in range(self.overlays):
+            res = name(f"O1OVL{o:03d}")
+            fp.write(field(afp.SF_BRS, res) + field(afp.SF_BMO, res) + field(afp.SF_BPT, res))
+            fp.write(self.ptxFields([(rnd.randrange(0, 10000), rnd.randrange(0, 1000), self.text(rnd)) for i in range(20)], rnd))
+            fp.write(field(afp.SF_EPT, res) + field(afp.SF_EMO, res) + field(afp.SF_ERS, res))
+
+        # Image resources..
+        for i, size in enumerate(self.images):
+            res = name(f"I1IMG{i:03d}")
+            fp.write(field(afp.SF_BRS, res) + field(afp.SF_BIM, res))
+            data = b"\xff\xd8\xff\xe0" + rnd.randbytes(max(0, size - 4))
+            for offset in range(0, len(data), 8000):
+                chunk = data[offset:offset+8000]
+                fp.write(field(afp.SF_IPD, b"\xfe\x92" + len(chunk).to_bytes(2, byteorder="big") + chunk))
+            fp.write(field(afp.SF_EIM, res) + field(afp.SF_ERS, res))
+
+        fp.write(field(afp.SF_ERG, name("RG")))
+
+        # Documents..
+        fp.write(field(afp.SF_BDT, name("DOC")))
+        for d in range(self.documents):
+            group = name(f"G{d:07d}")
+            fp.write(field(afp.SF_BNG, group))
+
+            for t in range(self.tles):
+                key = (f"Key{t}" if t else "CustomerInRun").encode(self.codepage)
+                value = f"{d:05d}".encode(self.codepage)
+                fp.write(field(afp.SF_TLE, bytes((len(key) + 4, 0x02, 0x0b, 0x00)) + key + bytes((len(value) + 4, 0x36, 0x00, 0x00)) + value))
+
+            for p in range(self.pages):
+                page = name(f"P{p:07d}")
+                fp.write(field(afp.SF_BPG, page) + field(afp.SF_BAG, page) + field(afp.SF_EAG, page))
+
+                for o in range(self.overlays):
+                    fp.write(field(afp.SF_IPO, name(f"O1OVL{o:03d}") + (0).to_bytes(3, byteorder="big") + (0).to_bytes(3, byteorder="big") + b"\x00\x00"))
+
+                fp.write(field(afp.SF_BPT, page))
+                # Five elements a line, lines are squeezed together to keep big pages on the page..
+                spacing = min(120, 60000 // max(1, self.elements // 5))
+                elements = [(rnd.randrange(0, 10000), 1000 + (e // 5) * spacing, self.text(rnd)) for e in range(self.elements)]
+                fp.write(self.ptxFields(elements, rnd))
+                fp.write(field(afp.SF_EPT, page) + field(afp.SF_EPG, page))
+
+            fp.write(field(afp.SF_ENG, group))
+        fp.write(field(afp.SF_EDT, name("DOC")))
+
+    def save(self, filename):
+        with open(filename, "wb") as fp:
+            self.write(fp)
+        return os.path.getsize(filename)
+
+
+# Benchmark matrix, (documents, pages, elements, overlays, tles, images)..
+MATRIX = {
+    "quick": (
+        (10, 2, 50, 1, 2, (10000,)),
+        (50, 2, 200, 2, 2, (50000,)),
+        ),
+    "default": (
+        (10, 2, 50, 1, 2, (10000,)),
+        (200, 2, 200, 2, 4, (50000, 200000)),
+        (1000, 1, 500, 3, 4, (500000,)),
+        (20, 5, 3000, 1, 2, ()),
+        ),
+    }
+
+
+def timeit(func, repeat):
+    """
+    Return the best time of repeat calls to func, and its last result
+    """
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best == None else min(best, elapsed)
+    return best, result
+
+
+def benchmark(filename, repeat=3):
+    """
+    Time the main AshyAFP operations on filename, returns a dict of seconds
+    """
+    timings = {}
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        timings["load"], a = timeit(lambda: afp.AshyAFP(filename, page_cache_size=0), repeat)
+
+    timings["_getResources"], count = timeit(a._getResources, repeat)
+
+    rawpages = [i.fields(a.data) for i in a.structure.find(afp.SF_BPG)]
+    timings["parsePage"], pages = timeit(lambda: [a.parsePage(i) for i in rawpages], repeat)
+
+    # Make sure page elements are built before timing the queries..
+    for page in pages:
+        page.elements
+
+    timings["getText"], result = timeit(lambda: [i.getText() for i in pages], repeat)
+    timings["findText"], result = timeit(lambda: [i.findText("Total") for i in pages], repeat)
+    timings["mergeElements"], result = timeit(lambda: [i.mergeElements(i.getTextElements()) for i in pages], repeat)
+
+    return timings
+
+
+def run(matrix, repeat=3, keep=None):
+    """
+    Write and benchmark every case in matrix, returns the JSON-able results
+    """
+    results = {
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "numpy": afp.numpy != None,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "cases": [],
+        }
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for documents, pages, elements, overlays, tles, images in matrix:
+            writer = SyntheticAFP(documents=documents, pages=pages, elements=elements, overlays=overlays, tles=tles, images=images)
+            filename = os.path.join(keep or tmp, f"bench_{documents}x{pages}x{elements}.afp")
+            size = writer.save(filename)
+
+            timings = benchmark(filename, repeat=repeat)
+            total_pages = documents * pages
+            results["cases"].append({
+                "params": writer.params(),
+                "file_size": size,
+                "pages": total_pages,
+                "timings": timings,
+                "pages_per_second": total_pages / timings["parsePage"] if timings["parsePage"] else None,
+                })
+            print(f"{documents}x{pages}x{elements}: " + ", ".join(f"{k} {v:.4f}s" for k, v in timings.items()), file=sys.stderr)
+
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark AshyAFP on synthetic AFP files")
+    parser.add_argument("-o", "--output", help="write the JSON results to this file (default stdout)")
+    parser.add_argument("-r", "--repeat", type=int, default=3, help="best of this many runs (default 3)")
+    parser.add_argument("--quick", action="store_true", help="only run the small cases")
+    parser.add_argument("--keep", metavar="DIR", help="keep the generated AFP files in DIR")
+    parser.add_argument("--documents", type=int, help="run a single case with this many documents")
+    parser.add_argument("--pages", type=int, default=2, help="pages per document for --documents")
+    parser.add_argument("--elements", type=int, default=100, help="PTX elements per page for --documents")
+    parser.add_argument("--overlays", type=int, default=1, help="overlays per page for --documents")
+    parser.add_argument("--tles", type=int, default=2, help="TLEs per document for --documents")
+    parser.add_argument("--images", type=int, nargs="*", default=[], help="image resource sizes for --documents")
+    args = parser.parse_args(argv)
+
+    if args.documents:
+        matrix = ((args.documents, args.pages, args.elements, args.overlays, args.tles, tuple(args.images)),)
+    else:
+        matrix = MATRIX["quick" if args.quick else "default"]
+
+    results = run(matrix, repeat=args.repeat, keep=args.keep)
+
+    if args.output:
+        with open(args.output, "w") as fp:
+            json.dump(results, fp, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main()
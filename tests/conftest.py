@@ -0,0 +1,61 @@
+import os
+import shutil
+import sys
+
+import pytest
+
+# Tests import AshyAFP and benchmark from the repository root..
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+TEST_AFP = os.path.join(ROOT, "test.afp")
+
+from AshyAFP import AshyAFP as AFP
+from benchmark import SyntheticAFP
+
+
+@pytest.fixture(scope="session")
+def files(tmp_path_factory):
+    """
+    test.afp (pages only) and synthetic spools with documents, overlays,
+    TLEs and an image, copied to a temporary folder for their sidecars
+    """
+    folder = tmp_path_factory.mktemp("afp")
+    test = str(folder / "test.afp")
+    shutil.copy(TEST_AFP, test)
+
+    spool = str(folder / "spool.afp")
+    SyntheticAFP(documents=6, pages=2, elements=60, overlays=2, tles=2, images=(5000,)).save(spool)
+
+    other = str(folder / "other.afp")
+    SyntheticAFP(documents=3, pages=1, elements=20, overlays=1, tles=1, seed=2).save(other)
+
+    return {"test": test, "spool": spool, "other": other}
+
+
+def pageElements(afp):
+    """
+    Return the elements of every page as tuples, document by document
+    """
+    if afp.documents:
+        sequence = [page for doc in afp.documents for page in doc.pages]
+    else:
+        sequence = list(afp.parsedPages or ())
+    return [tuple(tuple(i) for i in page.elements) for page in sequence]
+
+
+def documentTLEs(afp):
+    return [doc.tle for doc in afp.documents or ()]
+
+
+@pytest.fixture(scope="session")
+def baselines(files):
+    """
+    (page elements, document TLEs) of a plain load of every file
+    """
+    result = {}
+    for name, filename in files.items():
+        afp = AFP(filename)
+        result[name] = (pageElements(afp), documentTLEs(afp))
+        afp.close()
+    return result
@@ -0,0 +1,51 @@
+import json
+import os
+import shutil
+
+import pytest
+
+import AshyAFP
+
+
+def records(path):
+    with open(path) as fp:
+        return [json.loads(i) for i in fp]
+
+
+@pytest.mark.parametrize("workers", (1, 2))
+@pytest.mark.parametrize("output", ("text", "images"))
+def test_failed_file_skipped(files, tmp_path, capsys, workers, output):
+    bad = str(tmp_path / "bad.afp")
+    with open(bad, "wb") as fp:
+        fp.write(b"not an AFP file at all")
+    result = str(tmp_path / "out.jsonl")
+
+    argv = [files["spool"], bad, files["other"], "-t", output, "-o", result, "-w", str(workers),
+        "--images-dir", str(tmp_path / "images")]
+    assert AshyAFP.main(argv) == 1
+
+    err = capsys.readouterr().err
+    assert f"{bad}: AssertionError" in err
+    assert "1 of 3 files failed" in err
+    found = {i["file"] for i in records(result)}
+    assert bad not in found
+    assert files["spool"] in found
+    if output == "text":
+        assert files["other"] in found
+
+
+def test_images_same_basename(files, tmp_path):
+    for folder in ("a", "b"):
+        os.makedirs(tmp_path / folder)
+    first, second = str(tmp_path / "a" / "spool.afp"), str(tmp_path / "b" / "spool.afp")
+    shutil.copy(files["spool"], first)
+    shutil.copy(files["spool"], second)
+    result = str(tmp_path / "images.jsonl")
+
+    assert AshyAFP.main([first, second, "-t", "images", "-o", result, "-w", "1",
+        "--images-dir", str(tmp_path / "images")]) == 0
+
+    paths = {i["file"]: i["path"] for i in records(result)}
+    assert paths[first] != paths[second]
+    assert os.path.dirname(paths[first]) == str(tmp_path / "images" / "a" / "spool")
+    assert all(os.path.isfile(i) for i in paths.values())
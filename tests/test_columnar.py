@@ -0,0 +1,32 @@
+import pytest
+
+from AshyAFP import AshyAFP as AFP
+from conftest import documentTLEs as tles, pageElements as pages
+
+
+def allPages(afp):
+    return [page for doc in afp.documents for page in doc.pages] if afp.documents else list(afp.parsedPages)
+
+
+@pytest.mark.parametrize("name", ("test", "spool"))
+def test_columnar_load(files, baselines, name):
+    afp = AFP(files[name], columnar=True)
+    try:
+        assert (pages(afp), tles(afp)) == baselines[name]
+    finally:
+        afp.close()
+
+
+@pytest.mark.parametrize("name", ("test", "spool"))
+def test_columnar_queries(files, name):
+    # Every filter must give what the per-element code gives..
+    plain, columnar = allPages(AFP(files[name])), allPages(AFP(files[name], columnar=True))
+    for a, b in zip(plain, columnar):
+        colors = {i[2] for i in a.elements}
+        for area in (None, (0, 0, 10000, 10000), (0, 1000, 5000, 4000)):
+            for color in (None,) + tuple(colors)[:2]:
+                assert b.getText(area=area, color=color) == a.getText(area=area, color=color)
+                assert b.getText(area=area, color=color, sort=False) == a.getText(area=area, color=color, sort=False)
+                assert list(b.getTextElements(area=area, color=color)) == list(a.getTextElements(area=area, color=color))
+                assert list(b.getRules(area=area, color=color)) == list(a.getRules(area=area, color=color))
+        assert b.findText("Total|README") == a.findText("Total|README")
@@ -0,0 +1,37 @@
+import pytest
+
+from AshyAFP import AshyAFP as AFP, ElementArray
+from conftest import documentTLEs as tles, pageElements as pages
+
+ELEMENTS = [
+    (100, 200, 0, 0, "Total"),
+    (150, 200, 0xff, 90, "Due"),
+    (100, 300, 0, -1, ("I-Rule", 500, 10, 0)),
+    (120, 400, 0x197f33, 0, "Balance"),
+    (0, 0, 0, -1, ("B-Rule", 20, 3, 128)),
+    ]
+
+
+@pytest.mark.parametrize("name", ("test", "spool"))
+def test_compact_load(files, baselines, name):
+    afp = AFP(files[name], compact_elements=True)
+    try:
+        assert (pages(afp), tles(afp)) == baselines[name]
+        page = afp.documents[0].pages[0] if afp.documents else afp.parsedPages[0]
+        assert isinstance(page.elements, ElementArray)
+    finally:
+        afp.close()
+
+
+def test_element_array():
+    elements = ElementArray(ELEMENTS)
+    assert len(elements) == len(ELEMENTS)
+    assert list(elements) == ELEMENTS
+    assert [elements[i] for i in range(-len(ELEMENTS), len(ELEMENTS))] == ELEMENTS * 2
+    assert elements[1:4] == tuple(ELEMENTS[1:4])
+    assert elements == ELEMENTS
+
+    both = ElementArray(ELEMENTS)
+    both.extend(elements)
+    assert list(both) == ELEMENTS * 2
+    assert list(elements.moved(10, -5)) == [(i[0] + 10, i[1] - 5) + i[2:] for i in ELEMENTS]
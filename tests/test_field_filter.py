@@ -0,0 +1,36 @@
+import pytest
+
+import AshyAFP
+from AshyAFP import AshyAFP as AFP
+from conftest import documentTLEs as tles, pageElements as pages
+
+
+@pytest.mark.parametrize("name", ("test", "spool"))
+@pytest.mark.parametrize("options", ({}, {"use_mmap": True}, {"zero_copy": True}))
+@pytest.mark.parametrize("fields", (
+    {"include_fields": [AshyAFP.SF_PTX, AshyAFP.SF_TLE]},
+    {"exclude_fields": AshyAFP.BULK_DATA_FIELDS},
+    ))
+def test_field_filter(files, baselines, name, options, fields):
+    afp = AFP(files[name], **options, **fields)
+    try:
+        assert (pages(afp), tles(afp)) == baselines[name]
+
+        # Skipped fields keep their place with an empty payload..
+        plain = AFP(files[name])
+        assert [sf_id for sf_id, payload in afp.data] == [sf_id for sf_id, payload in plain.data]
+        skipped = [(sf_id, payload) for sf_id, payload in plain.data if afp._skipField(sf_id)]
+        assert all(len(payload) == 0 for sf_id, payload in afp.data if afp._skipField(sf_id))
+        assert afp.skipped_bytes == sum(len(payload) for sf_id, payload in skipped)
+    finally:
+        afp.close()
+
+
+def test_field_filter_keeps_structure(files):
+    # Begin/End fields, overlay includes and code pages are read whatever the filter..
+    afp = AFP(include_fields=())
+    for sf_id in (AshyAFP.SF_BNG, AshyAFP.SF_ENG, AshyAFP.SF_IPO, AshyAFP.SF_CPD):
+        assert not afp._skipField(sf_id)
+    assert afp._skipField(AshyAFP.SF_PTX)
+    assert AFP(exclude_fields=[AshyAFP.SF_PTX])._skipField(AshyAFP.SF_PTX)
+    assert not AFP(exclude_fields=[AshyAFP.SF_PTX])._skipField(AshyAFP.SF_TLE)
@@ -0,0 +1,55 @@
+import AshyAFP
+from AshyAFP import AshyAFP as AFP
+
+
+def documentElements(docs):
+    return [tuple(tuple(i) for i in page.elements) for doc in docs for page in doc.pages]
+
+
+def test_refresh_partial_writes(files, baselines, tmp_path):
+    with open(files["spool"], "rb") as fp:
+        data = fp.read()
+    follow = str(tmp_path / "follow.afp")
+    open(follow, "wb").close()
+
+    afp = AFP()
+    afp.follow(follow)
+    docs = []
+    # Odd sized chunks so most writes end part way through a field..
+    for start in range(0, len(data), 4099):
+        with open(follow, "ab") as fp:
+            fp.write(data[start:start+4099])
+        docs.extend(afp.refresh())
+
+        # Only whole fields are consumed, a partial one waits for the next refresh..
+        offset, complete = 0, 0
+        while offset + AshyAFP.SF_HEADER_SIZE <= start + 4099 and offset < len(data):
+            end = offset + AshyAFP.SF_HEADER.unpack_from(data, offset)[1] + 1
+            if end > start + 4099:
+                break
+            offset = complete = end
+        assert afp.follow_offset == complete
+
+    assert afp.follow_finished
+    assert afp.refresh() == []
+    assert (documentElements(docs), [doc.tle for doc in docs]) == baselines["spool"]
+    assert afp.documents == docs
+
+
+def test_follow_after_load(files, tmp_path):
+    follow = str(tmp_path / "empty.afp")
+    open(follow, "wb").close()
+
+    afp = AFP(files["test"])
+    afp.buildTextIndex()
+    afp.follow(follow)
+    assert afp.refresh() == []
+    # Nothing of test.afp may be seen until the first document arrives..
+    assert afp.pages == afp.parsedPages == None
+    assert afp.findText("README") == []
+
+    afp = AFP()
+    afp.scanOffsets(files["spool"])
+    afp.follow(follow)
+    assert afp.offsets == None
+    assert afp.findText("Total", rx=False) == []
@@ -0,0 +1,44 @@
+import io
+import os
+
+import pytest
+
+import AshyAFP
+from AshyAFP import AshyAFP as AFP, ImageResource
+
+
+def segmented(data, size):
+    """
+    An ImageResource holding data in segments of size bytes
+    """
+    return ImageResource("I1TEST", [(data, i, min(i + size, len(data))) for i in range(0, len(data), size)] if data else [])
+
+
+@pytest.mark.parametrize("size", (1, 3, 100))
+def test_image_format(size):
+    # Headers split over segments are still recognised..
+    for magic, ext in AshyAFP.afp_image_formats:
+        assert segmented(magic + bytes(range(40)), size).format() == ext
+    assert segmented(b"\x00\x01 uncompressed IOCA", size).format() == "bin"
+    assert segmented(b"\xff\xd8", size).format() == "bin" # Too short for JPEG's magic
+    assert segmented(b"", size).format() == "bin"
+
+
+@pytest.mark.parametrize("options", ({}, {"stream_images": True}, {"stream_images": True, "use_mmap": True}, {"zero_copy": True}))
+def test_image_resources(files, tmp_path, options):
+    expected = AFP(files["spool"]).resources["I1IMG000"] # Whole image as bytes
+
+    afp = AFP(files["spool"], **options)
+    images = list(afp.iterImageResources())
+    assert [(i.name, len(i), i.format()) for i in images] == [("I1IMG000", len(expected), "jpg")]
+    assert images[0].read() == expected
+    assert sum(len(i) for i in images[0].chunks()) == len(expected)
+
+    fp = io.BytesIO()
+    assert images[0].writeTo(fp) == len(expected)
+    assert fp.getvalue() == expected
+
+    afp.saveImageResources(str(tmp_path), workers=2 if options else None)
+    with open(os.path.join(tmp_path, "I1IMG000.jpg"), "rb") as fp:
+        assert fp.read() == expected
+    afp.close()
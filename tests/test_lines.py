@@ -0,0 +1,66 @@
+import pytest
+
+from AshyAFP import AshyAFP as AFP, Page
+
+
+def mergeReference(elements, delimiter=" "):
+    """
+    The original mergeElements, every y position gathered by a scan of all elements
+    """
+    merged = []
+    for ypos in sorted(set(i[1] for i in elements)):
+        line = sorted((i for i in elements if i[1] == ypos), key=lambda _: _[0])
+        if len(line) == 1:
+            merged.append(line[0])
+        else:
+            merged.append(line[0][:4] + (delimiter.join(i[4] for i in line if i[4].strip()),))
+    return merged
+
+
+@pytest.mark.parametrize("name", ("test", "spool"))
+def test_merge_elements_unchanged(files, name):
+    afp = AFP(files[name])
+    pages = [page for doc in afp.documents for page in doc.pages] if afp.documents else afp.parsedPages
+    for page in pages:
+        text = [tuple(i) for i in page.elements if i[3] != -1]
+        assert page.mergeElements(text) == mergeReference(text)
+        assert [i.element() for i in page.getLines()] == mergeReference(text)
+        assert page.mergeElements(text, delimiter="|") == mergeReference(text, delimiter="|")
+
+
+def test_line_tolerance():
+    elements = [
+        (300, 102, 0, 0, "world"),
+        (100, 100, 0, 0, "Hello"),
+        (200, 101, 0, 0, "there"),
+        (100, 104, 0, 0, "Next"), # Over the tolerance from the line's first baseline
+        (100, 200, 0, 0, " "),
+        (150, 200, 0, 0, "Last"),
+        ]
+    page = Page(elements=elements, line_tolerance=3)
+    assert page.mergeElements(elements) == [(100, 100, 0, 0, "Hello there world"), (100, 104, 0, 0, "Next"), (100, 200, 0, 0, "Last")]
+    assert [i.text for i in page.getLines()] == ["Hello there world", "Next", "Last"]
+
+    # Explicit arguments override the page's, lines are cached per setting..
+    assert [i.text for i in page.getLines(tolerance=0)] == ["Hello", "there", "world", "Next", "Last"]
+    assert [i.text for i in page.getLines(tolerance=5)] == ["Hello Next there world", "Last"]
+    assert [i.text for i in page.getLines()] == ["Hello there world", "Next", "Last"]
+    assert page.getText(mergeInlineElements=True) == "Hello there world\nNext\nLast"
+
+
+def test_line_gap():
+    elements = [(0, 100, 0, 0, "Name"), (60, 100, 0, 0, "Smith"), (1000, 100, 0, 0, "12.00"), (1050, 100, 0, 0, "GBP")]
+    page = Page(elements=elements, line_gap=100)
+    lines = page.getLines()
+    assert [(i.x, i.text) for i in lines] == [(0, "Name Smith"), (1000, "12.00 GBP")]
+    assert [len(i.elements) for i in lines] == [2, 2]
+    assert [i.text for i in page.getLines(gap=2000)] == ["Name Smith 12.00 GBP"]
+    assert page.mergeElements(elements, gap=40) == elements
+
+
+def test_line_options_from_load(files):
+    afp = AFP(files["spool"], line_tolerance=5, line_gap=400)
+    page = afp.documents[0].pages[0]
+    assert (page.line_tolerance, page.line_gap) == (5, 400)
+    text = [i for i in page.elements if i[3] != -1]
+    assert page.mergeElements(text) == Page().mergeElements(text, tolerance=5, gap=400)
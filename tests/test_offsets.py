@@ -0,0 +1,53 @@
+import os
+
+import pytest
+
+import AshyAFP
+from AshyAFP import AshyAFP as AFP
+
+
+@pytest.mark.parametrize("use_index", (False, True))
+def test_offset_table(files, baselines, use_index):
+    expected_pages, expected_tles = baselines["spool"]
+
+    for attempt in range(2): # The second scan reads the sidecar if use_index
+        afp = AFP(use_index=use_index)
+        assert afp.scanOffsets(files["spool"]) == len(expected_tles)
+
+        assert [afp.getDocument(i).tle for i in range(len(expected_tles))] == expected_tles
+        assert [doc.tle for doc in afp.getDocument(slice(1, 4))] == expected_tles[1:4]
+        assert afp.getDocument(-1).tle == expected_tles[-1]
+
+        found = [tuple(tuple(e) for e in page.elements) for i in range(len(expected_tles)) for page in afp.getPage(i, slice(None))]
+        assert found == expected_pages
+        assert tuple(tuple(e) for e in afp.getPage(2, 1).elements) == expected_pages[5]
+
+    if use_index:
+        os.remove(files["spool"] + AshyAFP.OFFSETS_SUFFIX)
+
+
+def test_offset_table_pages_only(files, baselines):
+    afp = AFP()
+    assert afp.scanOffsets(files["test"]) == 0
+    assert [tuple(tuple(e) for e in afp.getPage(0, i).elements) for i in range(afp.offsets.pageCount())] == baselines["test"][0]
+
+
+def test_offset_table_switching_files(files, baselines):
+    afp = AFP()
+    for name in ("spool", "other", "spool"):
+        afp.scanOffsets(files[name])
+        assert tuple(tuple(e) for e in afp.getPage(0, 0).elements) == baselines[name][0][0]
+
+
+def test_offset_table_after_load(files, baselines):
+    afp = AFP(files["test"])
+    afp.buildTextIndex()
+
+    afp.scanOffsets(files["spool"])
+    assert afp.findText("README") == []
+    assert afp.getPage(0, 0).elements == afp.getDocument(0).pages[0].elements
+    assert tuple(tuple(e) for e in afp.getPage(1, 1).elements) == baselines["spool"][0][3]
+    assert afp.findText("Total", rx=False) == AFP(files["spool"]).findText("Total", rx=False)
+
+    afp.scanOffsets(files["test"]) # Pages only
+    assert afp.findText("README") == AFP(files["test"]).findText("README") != []
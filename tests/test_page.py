@@ -0,0 +1,67 @@
+import random
+
+import pytest
+
+from AshyAFP import AshyAFP as AFP
+
+
+def pageAt(files, name, **options):
+    afp = AFP(files[name], **options)
+    page = afp.documents[0].pages[0] if afp.documents else afp.parsedPages[0]
+    afp.close()
+    return page
+
+
+def inArea(elements, area, rules=False):
+    """
+    The elements within area the simple way, in (y, x) order
+    """
+    x1, y1, x2, y2 = area
+    return sorted((tuple(i) for i in elements if (i[3] == -1) == rules and x1 <= i[0] <= x2 and y1 <= i[1] <= y2),
+        key=lambda i: (i[1], i[0]))
+
+
+@pytest.mark.parametrize("options", ({}, {"columnar": True}, {"compact_elements": True}))
+def test_elements_setter_resets_caches(files, options):
+    page = pageAt(files, "spool", **options)
+    area = (0, 0, 10000, 10000)
+
+    # Build the area index, columns and lines from the full page..
+    assert len(page.getTextElements(area=area)) > 3
+    page.getTextElements(mergeInlineElements=True)
+
+    page.elements = page.elements[:3]
+    text = [tuple(i) for i in page.elements if i[3] != -1]
+
+    assert [tuple(i) for i in page.getTextElements(area=area)] == inArea(page.elements, area)
+    assert len(page.getTextElements()) == len(text)
+    assert sum(len(i[4].split()) for i in page.getTextElements(mergeInlineElements=True)) == sum(len(i[4].split()) for i in text)
+
+
+@pytest.mark.parametrize("name", ("test", "spool"))
+@pytest.mark.parametrize("options", ({}, {"columnar": True}, {"compact_elements": True}))
+def test_area_queries(files, name, options):
+    afp = AFP(files[name], **options)
+    pages = [page for doc in afp.documents for page in doc.pages] if afp.documents else afp.parsedPages
+    rng = random.Random(1)
+
+    for page in pages:
+        elements = [tuple(i) for i in page.elements]
+        xs, ys = [i[0] for i in elements], [i[1] for i in elements]
+
+        # Random areas plus ones with their edges on element positions (edges are inside)..
+        areas = [(0, 0, 100000, 100000), (-10, -10, -1, -1)]
+        for _ in range(20):
+            x1, x2 = sorted(rng.sample(xs, 2) if len(xs) > 1 else xs * 2)
+            y1, y2 = sorted(rng.sample(ys, 2) if len(ys) > 1 else ys * 2)
+            areas.append((x1, y1, x2, y2))
+            (x1, x2), (y1, y2) = sorted(rng.randint(0, 10000) for _ in "xx"), sorted(rng.randint(0, 10000) for _ in "yy")
+            areas.append((x1, y1, x2, y2))
+
+        for area in areas:
+            expected = inArea(elements, area)
+            assert [tuple(i) for i in page.getTextElements(area=area)] == expected
+            assert [tuple(i) for i in page.getTextElements(area=area, sort=False)] == [i for i in elements if i in expected]
+            rules = inArea(elements, area, rules=True)
+            assert [tuple(i) for i in page.getRules(area=area)] == [i for i in elements if i in rules]
+    afp.close()
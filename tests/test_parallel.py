@@ -0,0 +1,34 @@
+import concurrent.futures
+import threading
+
+import AshyAFP
+from AshyAFP import AshyAFP as AFP
+
+
+def pageTexts(doc):
+    return doc.tle, [page.getText() for page in doc.pages]
+
+
+def test_map_documents(files):
+    afp = AFP(files["spool"])
+    expected = [pageTexts(doc) for doc in afp.documents]
+    afp.close()
+
+    assert list(AFP.mapDocuments(files["spool"], pageTexts, workers=2, docs_per_shard=2)) == expected
+    assert [pageTexts(doc) for doc in AFP.mapDocuments(files["spool"], workers=2)] == expected
+
+
+def test_ordered_results_are_bounded():
+    submitted = []
+    lock = threading.Lock()
+
+    def job(n):
+        with lock:
+            submitted.append(n)
+        return n
+
+    with concurrent.futures.ThreadPoolExecutor(2) as executor:
+        results = AshyAFP._orderedResults(executor, job, ((n,) for n in range(20)), 3)
+        assert next(results) == 0
+        assert len(submitted) <= 3 # Nothing more is submitted until results are used
+        assert list(results) == list(range(1, 20))
@@ -0,0 +1,51 @@
+import pytest
+
+import AshyAFP
+from AshyAFP import AshyAFP as AFP, PatternSet
+
+TEXTS = ["ushers", "his hers", "HE said", "", "shehishe", "she", "Account Balance: 12"]
+
+
+@pytest.mark.parametrize("ignoreCase", (False, True))
+@pytest.mark.parametrize("exactMatch", (False, True))
+def test_pattern_set(ignoreCase, exactMatch):
+    # Overlapping literals, checked against searching for each pattern on its own..
+    literals = ["he", "she", "his", "hers", "she"]
+    regexes = [r"\d+", r"^h"]
+    patterns = PatternSet(literals, regexes, exactMatch=exactMatch, ignoreCase=ignoreCase)
+    assert len(patterns) == 7
+
+    fold = (lambda i: i.casefold()) if ignoreCase else (lambda i: i)
+    flags = AshyAFP.re.IGNORECASE if ignoreCase else 0
+    for text in TEXTS:
+        if exactMatch:
+            expected = [n for n, i in enumerate(literals) if fold(i) == fold(text)]
+            expected += [len(literals) + n for n, i in enumerate(regexes) if AshyAFP.re.fullmatch(i, text, flags)]
+        else:
+            expected = [n for n, i in enumerate(literals) if fold(i) in fold(text)]
+            expected += [len(literals) + n for n, i in enumerate(regexes) if AshyAFP.re.search(i, text, flags)]
+        assert patterns.match(text) == expected, text
+
+
+def test_find_patterns(files):
+    afp = AFP(files["spool"])
+    literals = ["Total", "Due", "the", "Account Balance"]
+    regexes = [r"\bof\b"]
+
+    found = afp.findPatterns(AshyAFP.PatternSet(literals, regexes))
+    expected = []
+    for doc_num, doc in enumerate(afp.documents):
+        for page_num, page in enumerate(doc.pages):
+            for elem in page.elements:
+                if elem[3] == -1:
+                    continue
+                expected.extend((doc_num, page_num, literal) + tuple(elem) for literal in literals if literal in elem[4])
+                if AshyAFP.re.search(regexes[0], elem[4]):
+                    expected.append((doc_num, page_num, regexes[0]) + tuple(elem))
+
+    key = lambda i: (i[0], i[1], i[3:], i[2])
+    assert sorted(found, key=key) == sorted(expected, key=key)
+
+    limited = afp.findPatterns(literals, limit=2)
+    assert all(sum(1 for i in limited if i[0] == doc_num) <= 2 for doc_num in range(len(afp.documents)))
+    assert len(afp.findPatterns(literals, first=True)) == 1
@@ -0,0 +1,76 @@
+import os
+
+import pytest
+
+import AshyAFP
+from AshyAFP import AshyAFP as AFP
+from conftest import documentTLEs, pageElements
+
+
+@pytest.mark.parametrize("name", ("test", "spool"))
+@pytest.mark.parametrize("fields", ({}, {"include_fields": [AshyAFP.SF_PTX, AshyAFP.SF_TLE]}))
+def test_sidecar_index(files, baselines, name, fields):
+    filename = files[name]
+    index_file = filename + AshyAFP.INDEX_SUFFIX
+
+    # Written by a load without the index, read back by the next load..
+    afp = AFP(filename, **fields)
+    afp.saveIndex()
+    afp.close()
+
+    afp = AFP(filename, use_index=True, **fields)
+    try:
+        assert afp.index_loaded
+        assert (pageElements(afp), documentTLEs(afp)) == baselines[name]
+    finally:
+        afp.close()
+
+    # A truncated sidecar is stale, the file is read and indexed again..
+    with open(index_file, "r+b") as fp:
+        fp.truncate(300)
+
+    afp = AFP(filename, use_index=True, **fields)
+    try:
+        assert not afp.index_loaded
+        assert (pageElements(afp), documentTLEs(afp)) == baselines[name]
+    finally:
+        afp.close()
+
+    os.remove(index_file)
+
+
+def test_documents_are_built_lazily(files, baselines):
+    afp = AFP(files["spool"], use_index=True)
+    afp.close()
+
+    afp = AFP(files["spool"], use_index=True)
+    try:
+        assert afp.index_loaded
+        assert isinstance(afp.documents, AshyAFP.LazyDocuments)
+        assert afp.documents[-1] is afp.documents[len(afp.documents) - 1]
+        assert [doc.tle for doc in afp.documents[1:3]] == baselines["spool"][1][1:3]
+    finally:
+        afp.close()
+
+    os.remove(files["spool"] + AshyAFP.INDEX_SUFFIX)
+
+
+def test_unwritable_sidecar(files, baselines, tmp_path):
+    # ie. a read-only archive folder..
+    afp = AFP(files["spool"], use_index=True, index_file=str(tmp_path / "missing" / "spool.afpidx"))
+    try:
+        assert not afp.index_loaded
+        assert (pageElements(afp), documentTLEs(afp)) == baselines["spool"]
+    finally:
+        afp.close()
+    assert not os.path.exists(tmp_path / "missing")
+
+
+def test_unwritable_offsets_sidecar(files, baselines, monkeypatch):
+    def refuse(self, path, header, arrays):
+        raise PermissionError(13, "Permission denied", path)
+    monkeypatch.setattr(AFP, "_writeSidecar", refuse)
+
+    afp = AFP(use_index=True)
+    assert afp.scanOffsets(files["spool"]) == len(baselines["spool"][1])
+    assert afp.getDocument(-1).tle == baselines["spool"][1][-1]
@@ -0,0 +1,26 @@
+from AshyAFP import AshyAFP as AFP
+from conftest import pageElements
+
+
+def streamed(afp, filename):
+    """
+    Return (page elements, TLEs) of the documents iterDocuments() yields
+    """
+    docs = list(afp.iterDocuments(filename))
+    return [tuple(tuple(i) for i in page.elements) for doc in docs for page in doc.pages], [doc.tle for doc in docs]
+
+
+def test_iter_documents(files, baselines):
+    assert streamed(AFP(), files["spool"]) == baselines["spool"]
+
+
+def test_iter_documents_across_files(files, baselines):
+    # The overlays of both spools share names, none may be reused..
+    afp = AFP()
+    for name in ("spool", "other", "spool"):
+        assert streamed(afp, files[name]) == baselines[name]
+
+    afp = AFP(files["spool"])
+    pageElements(afp) # Parse (and cache) the loaded file's overlays and pages
+    assert streamed(afp, files["other"]) == baselines["other"]
+    afp.close()
@@ -0,0 +1,64 @@
+import pytest
+
+import AshyAFP
+from AshyAFP import AshyAFP as AFP
+from conftest import documentTLEs, pageElements
+
+
+def referenceTree(ids):
+    """
+    Return {start: (id, end, parent start, tle positions)} of the Begin/End
+    nesting of field ids, built the simple way
+    """
+    nodes = {}
+    stack = [None]
+    for i, f_id in enumerate(ids):
+        if f_id >> 16 != 0xd3:
+            continue
+        f_type = (f_id >> 8) & 0xff
+        if f_type == 0xa8:
+            nodes[i] = [f_id, None, stack[-1], []]
+            stack.append(i)
+        elif f_type == 0xa9:
+            nodes[stack.pop()][1] = i
+        elif f_id == AshyAFP.SF_TLE and stack[-1] != None:
+            nodes[stack[-1]][3].append(i)
+    return nodes
+
+
+@pytest.mark.parametrize("name", ("test", "spool"))
+def test_structure_matches_reference(files, name):
+    afp = AFP(files[name], use_mmap=True)
+    try:
+        expected = referenceTree(afp.data.fieldIds())
+        root = afp.structure
+
+        found = {}
+        parents = {root.num: None}
+        for node in root.walk():
+            for child in node.children:
+                parents[child.num] = node.start if node.sf_id else None
+            if node.sf_id:
+                direct = [i for i in node.tleIndexes() if not any(i in c.tleIndexes() for c in node.children)]
+                found[node.start] = [node.sf_id, node.end, parents[node.num], direct]
+        assert found == expected
+
+        assert [(i.start, i.end) for i in root.find(AshyAFP.SF_BPG)] == sorted(
+            (start, node[1]) for start, node in expected.items() if node[0] == AshyAFP.SF_BPG)
+
+        # Round trip through the sidecar arrays..
+        copy = AshyAFP.StructureNode.fromArrays(*root.toArrays())
+        assert [(i.sf_id, i.start, i.end) for i in copy.walk()] == [(i.sf_id, i.start, i.end) for i in root.walk()]
+    finally:
+        afp.close()
+
+
+@pytest.mark.parametrize("name", ("test", "spool"))
+def test_mmap_load(files, baselines, name):
+    afp = AFP(files[name], use_mmap=True)
+    try:
+        assert (pageElements(afp), documentTLEs(afp)) == baselines[name]
+        # Page fields are only sliced out of the index when used..
+        assert afp.pages == None or isinstance(afp.pages, AshyAFP.FieldRanges)
+    finally:
+        afp.close()
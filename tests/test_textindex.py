@@ -0,0 +1,47 @@
+import pytest
+
+import AshyAFP
+from conftest import TEST_AFP
+
+
+PATTERNS = (
+    ("", True),
+    (r"^\s*$", True),
+    (" ", False),
+    ("e", False),
+    ("Total", False),
+    (r"\d+", True),
+    (r"[A-Z]{3,}", True),
+    ("a|e", True),
+    )
+
+
+@pytest.fixture(scope="module")
+def afp():
+    return AshyAFP.AshyAFP(TEST_AFP)
+
+
+@pytest.mark.parametrize("text, rx", PATTERNS)
+@pytest.mark.parametrize("exactMatch", (False, True))
+def test_indexed_matches_unindexed(afp, text, rx, exactMatch):
+    afp.text_index = None
+    expected = afp.findText(text, rx=rx, exactMatch=exactMatch)
+
+    afp.buildTextIndex()
+    try:
+        assert afp.findText(text, rx=rx, exactMatch=exactMatch) == expected
+    finally:
+        afp.text_index = None
+
+
+def test_index_dropped_on_load(files):
+    afp = AshyAFP.AshyAFP(TEST_AFP)
+    afp.buildTextIndex()
+
+    afp.load(files["spool"])
+    assert afp.text_index == None
+    expected = [(doc_num, page_num) + tuple(elem) for doc_num, doc in enumerate(afp.documents)
+        for page_num, elem in ((page_num, elem) for page_num, page in enumerate(doc.pages) for elem in page.elements)
+        if elem[3] != -1 and "Total" in elem[4]]
+    assert afp.findText("Total", rx=False) == expected
+    afp.close()
@@ -0,0 +1,33 @@
+from AshyAFP import AshyAFP as AFP
+
+
+def elements(doc):
+    return [tuple(tuple(i) for i in page.elements) for page in doc.pages]
+
+
+def test_scan_tles(files, baselines):
+    expected_tles = baselines["spool"][1]
+
+    afp = AFP()
+    assert afp.scanTLEs(files["spool"]) == len(expected_tles)
+    assert afp.document_tles == expected_tles
+    assert afp.documents == None # Nothing parsed until found
+
+    loaded = AFP(files["spool"])
+    for num, tle in enumerate(expected_tles):
+        found = afp.findDocuments(tle)
+        assert [doc.tle for doc in found] == [tle]
+        assert elements(found[0]) == elements(loaded.documents[num])
+
+    # Every document sharing one key/value, and the same from the loaded file's index..
+    key, value = next(iter(expected_tles[0].items()))
+    matching = [tle for tle in expected_tles if tle.get(key) == value]
+    assert [doc.tle for doc in afp.findDocuments(**{key: value})] == matching
+    assert [doc.tle for doc in loaded.findDocuments({key: value})] == matching
+    assert afp.findDocuments({key: value, "No such key": "x"}) == []
+
+
+def test_scan_tles_pages_only(files):
+    afp = AFP()
+    assert afp.scanTLEs(files["test"]) == 0
+    assert afp.document_tles == []
@@ -0,0 +1,16 @@
+import pytest
+
+from AshyAFP import AshyAFP as AFP
+from conftest import documentTLEs as tles, pageElements as pages
+
+
+@pytest.mark.parametrize("name", ("test", "spool"))
+@pytest.mark.parametrize("options", ({}, {"use_mmap": True}))
+def test_zero_copy(files, baselines, name, options):
+    afp = AFP(files[name], zero_copy=True, **options)
+    try:
+        assert all(isinstance(payload, memoryview) for sf_id, payload in afp.data)
+        assert (pages(afp), tles(afp)) == baselines[name]
+        assert afp.findText("Total", rx=False) == AFP(files[name]).findText("Total", rx=False)
+    finally:
+        afp.close()